@@ -1,23 +1,131 @@
+import asyncio
+import atexit
+import heapq
+import logging
+import logging.handlers
+import queue
 import time
 import sys
 import random
-# Import the PCA9685 module.
-import Adafruit_PCA9685
+from array import array
+from functools import lru_cache
+import oscillators
+import trajectories
+# AdafruitBackend drives the real chip, pca9685_backends.SimulatedPCA9685 runs without hardware
+from pca9685_backends import AdafruitBackend
 
 # Initialise the PCA9685 using the default address (0x40).
-pwm = Adafruit_PCA9685.PCA9685()
+# The I2C bus is not opened until the first write, so importing this module does not touch the chip.
+# stagger gives every channel its own pulse start so the servos do not all draw current at the same moment.
+pwm = AdafruitBackend(stagger=True)
 
 # Alternatively specify a different address and/or bus:
-# pwm = Adafruit_PCA9685.PCA9685(address=0x41, busnum=2)
-
-# Configure min and max servo pulse lengths
-servo_min = 120
-servo_max = 650
+# pwm = AdafruitBackend(address=0x41, busnum=2, stagger=True)
+# or run everything against a simulated chip:
+# from pca9685_backends import SimulatedPCA9685
+# pwm = SimulatedPCA9685()
+# Servos moved from more than one thread should get a threaded_controller.ThreadedController(pwm) as their
+# pwm_backend, writing to pwm itself from several threads at once can mix up the writes of different channels.
+
+# Configure min and max servo pulse lengths in microseconds, these are the pulses for 0 and 180 degrees.
+# They are converted to ticks from the chip's real PWM period, so changing the frequency keeps the same pulses.
+servo_min_us = 490
+servo_max_us = 2725
 servo_frequency = 60
+# Number of position updates per second while gliding, there is no point in updating faster than the servo pulses
+glide_rate = servo_frequency
+# Easing curve used by glides unless one is given, see trajectories.curves
+glide_easing = "linear"
+# Step in degrees of the angle -> pulse width lookup tables every servo uses
+angle_resolution = 0.1
 # Set frequency to 60hz, good for servos.
+# This only takes effect on the first write, and is skipped when the chip is already running at this frequency
 pwm.set_pwm_freq(servo_frequency)
 
 
+# Everything is logged through this logger, nothing is formatted unless its level is enabled.
+# Moves of servos and groups created with info_print=True are logged at INFO, all other moves at DEBUG.
+# setup_logging() sends the records to stdout from a background thread.
+logger = logging.getLogger("PCAde9685")
+
+
+class ChannelRateLimit(logging.Filter):
+    # lets at most one record per channel through every interval seconds, records without a channel always pass
+
+    def __init__(self, interval=1.0):
+        super().__init__()
+        self.interval = interval
+        self.last_times = {}
+
+    def filter(self, record):
+        channel = getattr(record, "channel", None)
+        if channel is None:
+            return True
+        now = time.monotonic()
+        last_time = self.last_times.get(channel)
+        if last_time is not None and now - last_time < self.interval:
+            return False
+        self.last_times[channel] = now
+        return True
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler formats the message before queueing it. Records whose arguments are all numbers
+    # and strings are queued as they are and formatted by the listener thread. Lists and arrays (eg. the angles
+    # of a group) can still change before the listener gets to them, so those records are formatted here.
+
+    def prepare(self, record):
+        if isinstance(record.args, tuple) and not all(isinstance(arg, (int, float, str)) for arg in record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+_log_listener = None
+
+
+def _stop_log_listener():
+    # writes out whatever is still queued, registered with atexit by setup_logging
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+def setup_logging(level=logging.INFO, rate_limit=1.0, handler=None):
+    # Sends the records of this module to handler (stdout by default) from a background thread, so the code
+    # moving the servos only puts records on a queue and never waits for the output.
+    # rate_limit is the least number of seconds between two records about the same channel, None for all of them.
+    global _log_listener
+    if _log_listener is not None:
+        _stop_log_listener()
+        for old_handler in [h for h in logger.handlers if isinstance(h, _DeferredQueueHandler)]:
+            logger.removeHandler(old_handler)
+    if handler is None:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+    log_queue = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    if rate_limit:
+        queue_handler.addFilter(ChannelRateLimit(rate_limit))
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    _log_listener = logging.handlers.QueueListener(log_queue, handler)
+    _log_listener.start()
+    # registered once however often this is called
+    atexit.unregister(_stop_log_listener)
+    atexit.register(_stop_log_listener)
+    return _log_listener
+
+
+def log_move(info_print, channel, message, *args):
+    # channel is what rate limiting goes by: a servo's channel, or the group the message is about
+    level = logging.INFO if info_print else logging.DEBUG
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *args, extra={"channel": channel})
+
+
 def translate(value, left_min, left_max, right_min, right_max):
     # Figure out how 'wide' each range is
     left_span = left_max - left_min
@@ -30,99 +138,339 @@ def translate(value, left_min, left_max, right_min, right_max):
     return right_min + (value_scaled * right_span)
 
 
+def pulse_ticks(angle, min_ticks, max_ticks, angle_range=180):
+    # pulse width in ticks for an angle between 0 and angle_range
+    duty_cycle = angle / angle_range
+    pulse_width = min_ticks + (max_ticks - min_ticks) * duty_cycle
+    return int(pulse_width + 0.5)
+
+
+@lru_cache(maxsize=None)
+def tick_table(servo_min_bound, servo_max_bound, resolution, min_ticks, max_ticks, angle_range=180):
+    # The pulse width in ticks for every angle from 0 to 180 in steps of resolution, after remapping the
+    # angle to the servo's bounds. Servos with the same calibration share one table.
+    table = array('H')
+    for step in range(int(round(180 / resolution)) + 1):
+        angle = min(step * resolution, 180)
+        if servo_min_bound != 0 or servo_max_bound != 180:
+            angle = translate(angle, 0, 180, servo_min_bound, servo_max_bound)
+        table.append(max(0, pulse_ticks(angle, min_ticks, max_ticks, angle_range)))
+    return table
+
+
+class CalibrationAttribute:
+    # a Servo attribute that throws away the servo's lookup table whenever it is changed
+
+    def __set_name__(self, owner, name):
+        self.name = "_" + name
+
+    def __get__(self, servo, owner=None):
+        if servo is None:
+            return self
+        return getattr(servo, self.name)
+
+    def __set__(self, servo, value):
+        setattr(servo, self.name, value)
+        servo.tick_table = None
+        if getattr(servo, "bank", None) is not None:
+            servo.bank.refresh(servo.bank_index)
+
+
+def servo_backend(pwm_backend=None):
+    # backends handed to servos run at servo_frequency unless they were already given a frequency
+    backend = pwm_backend if pwm_backend is not None else pwm
+    if backend.frequency_hz is None:
+        backend.set_pwm_freq(servo_frequency)
+    return backend
+
+
+def set_servo_pwms(servo_ticks):
+    # servo_ticks is a list of (servo, (on, off)) pairs
+    # the servos are grouped by the backend they are wired to and each backend gets one bulk write
+    backend_ticks = {}
+    for servo, ticks in servo_ticks:
+        backend_ticks.setdefault(servo.pwm, {})[servo.channel] = ticks
+    for backend, channel_ticks in backend_ticks.items():
+        backend.set_multiple_pwm(channel_ticks)
+
+
+def run_steps(steps):
+    # Routines are written as generators: they do their writes and yield how many seconds to wait
+    # before the next ones. This drives such a generator by sleeping, run_steps_async by awaiting.
+    # The waits are measured against absolute deadlines on the monotonic clock, so the time spent writing
+    # is taken out of the next wait and the routine's total duration does not drift.
+    # Routines with a duration count their time from the waits they yield rather than from a clock, so they
+    # also run on a virtual clock, eg. when shows.render_show renders them without sleeping.
+    deadline = time.monotonic()
+    for delay_amount in steps:
+        deadline += delay_amount
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+
+async def run_steps_async(steps):
+    # cancelling the task stops the routine at the current wait, every servo stays where it was last written
+    try:
+        deadline = time.monotonic()
+        for delay_amount in steps:
+            deadline += delay_amount
+            await asyncio.sleep(max(0.0, deadline - time.monotonic()))
+    finally:
+        steps.close()
+
+
+def glide_frames(starting_angle, ending_angle, time_to_take, update_rate=None, easing=None, max_acceleration=None):
+    # Splits a glide into (angle, seconds to wait before it) frames at update_rate frames per second,
+    # so the number of writes depends on the duration and not on how many degrees are covered.
+    # The motion follows the easing curve, or a trapezoid that keeps under max_acceleration (degrees/s^2);
+    # the profile comes from a cached table so nothing but a multiply-add is done per frame.
+    if update_rate is None:
+        update_rate = glide_rate
+    if easing is None:
+        easing = glide_easing
+    easing, time_to_take, accel_fraction = trajectories.plan(
+        ending_angle - starting_angle, time_to_take, easing, max_acceleration)
+    frame_time, table = trajectories.progress_table(easing, time_to_take, update_rate, accel_fraction)
+    span = ending_angle - starting_angle
+    for progress in table:
+        yield starting_angle + span * progress, frame_time
+
+
+def handle_steps(handle, poll_time=0.005):
+    # waits for a MotionScheduler handle inside a routine generator (see run_steps), so the steps after it
+    # only start once the motion has finished
+    while not handle.done():
+        yield poll_time
+
+
+async def wait_for_async(handle, poll_time=0.005):
+    # waits for a MotionScheduler handle without blocking the event loop, cancelling also cancels the motion
+    # the handle is polled rather than waited on in an executor thread, so any number of motions can be
+    # awaited at once however few threads the default executor has
+    try:
+        for delay in handle_steps(handle, poll_time):
+            await asyncio.sleep(delay)
+    except asyncio.CancelledError:
+        handle.cancel()
+        raise
+
+
+def oscillate_steps(servos, servo_oscillators, duration, update_rate=None, clock_start=0):
+    # Swings every servo along its oscillators.Oscillator for duration seconds, as a routine generator
+    # (see run_steps). All of them are worked out together on every frame and go out in one bulk write,
+    # leaving out the servos whose pulse width did not change.
+    if update_rate is None:
+        update_rate = glide_rate
+    previous = [None] * len(servos)
+    for angles, frame_time in oscillators.oscillation_frames(servo_oscillators, duration, update_rate):
+        servo_ticks = []
+        for index, (servo, angle) in enumerate(zip(servos, angles)):
+            servo.currentAngle, pulse_width = servo.pulse_width(angle)
+            if pulse_width != previous[index]:
+                previous[index] = pulse_width
+                servo_ticks.append((servo, (clock_start, pulse_width + clock_start)))
+        if servo_ticks:
+            set_servo_pwms(servo_ticks)
+        yield frame_time
+
+
+def oscillate(servos, servo_oscillators, duration, update_rate=None, clock_start=0):
+    run_steps(oscillate_steps(servos, servo_oscillators, duration, update_rate, clock_start))
+
+
+async def oscillate_async(servos, servo_oscillators, duration, update_rate=None, clock_start=0):
+    await run_steps_async(oscillate_steps(servos, servo_oscillators, duration, update_rate, clock_start))
+
+
 class Servo:
     # frequency is the number of pulses per second
     # each pulse has 4096 clock sections
     # on: The tick (between 0 and 4095) when the signal should transition from low to high
     # off:the tick (between 0 and 4095) when the signal should transition from high to low
 
-    def __init__(self, channel, servo_min_bound=0, servo_max_bound=180, current_angle="unknown", info_print=False):
+    # changing any of these rebuilds the lookup table on the next write
+    servo_min_bound = CalibrationAttribute()
+    servo_max_bound = CalibrationAttribute()
+    min_pulse_us = CalibrationAttribute()
+    max_pulse_us = CalibrationAttribute()
+    angle_range = CalibrationAttribute()
+    resolution = CalibrationAttribute()
+
+    def __init__(self, channel, servo_min_bound=0, servo_max_bound=180, current_angle="unknown", info_print=False,
+                 pwm_backend=None, scheduler=None, resolution=None, min_pulse_us=None, max_pulse_us=None,
+                 angle_range=180):
+        # min_pulse_us and max_pulse_us are the pulses for 0 and angle_range degrees of this servo,
+        # they default to the module's servo_min_us and servo_max_us
         self.channel = channel
+        # the backend this servo is wired to, defaults to the module's pwm
+        self.pwm = servo_backend(pwm_backend)
+        # with a MotionScheduler the movement methods return a handle right away instead of sleeping
+        self.scheduler = scheduler
+        # set when the servo is part of a servo_bank.ServoBank, its angle then lives in the bank's arrays
+        self.bank = None
+        self.bank_index = None
         self.currentAngle = current_angle
         self.info_print = info_print
+        # angle -> pulse width lookup table, rebuilt on the next write whenever the calibration changes
+        self.tick_table = None
+        self.resolution = resolution if resolution is not None else angle_resolution
+        self.min_pulse_us = min_pulse_us if min_pulse_us is not None else servo_min_us
+        self.max_pulse_us = max_pulse_us if max_pulse_us is not None else servo_max_us
+        self.angle_range = angle_range
         self.servo_min_bound = servo_min_bound
         self.servo_max_bound = servo_max_bound
-        if self.info_print:
-            print(
-                f'Initializing Servo on channel {self.channel} with range {self.servo_min_bound} '
-                f'to {self.servo_max_bound} degrees.')
+        log_move(self.info_print, None, "Initializing Servo on channel %s with range %s to %s degrees.",
+                 self.channel, self.servo_min_bound, self.servo_max_bound)
 
     def __str__(self):
         return f"Servo on channel {self.channel} at {self.currentAngle} degrees"
 
+    @property
+    def currentAngle(self):
+        if self.bank is not None:
+            return self.bank.angle_of(self.bank_index)
+        return self._current_angle
+
+    @currentAngle.setter
+    def currentAngle(self, angle):
+        if self.bank is not None:
+            self.bank.set_angle_of(self.bank_index, angle)
+        else:
+            self._current_angle = angle
+
     def set_info_print(self, info_print):
         self.info_print = info_print
 
-    def set_angle(self, angle=90, delay_amount=0.3, clock_start=0):
-        self.currentAngle = angle
+    def build_tick_table(self):
+        self._table_frequency = self.pwm.frequency_hz
+        min_ticks = self.pwm.microseconds_to_ticks(self.min_pulse_us)
+        max_ticks = self.pwm.microseconds_to_ticks(self.max_pulse_us)
+        self.tick_table = tick_table(self.servo_min_bound, self.servo_max_bound, self.resolution,
+                                     min_ticks, max_ticks, self.angle_range)
+        # remapping an angle to the bounds is a single multiply-add with these
+        self._angle_scale = (self.servo_max_bound - self.servo_min_bound) / 180
+        self._index_scale = 1 / self.resolution
+
+    def pulse_width(self, angle):
+        # returns the angle after remapping to this servo's bounds and the pulse width in ticks for it
+        if self.tick_table is None or self.pwm.frequency_hz != self._table_frequency:
+            self.build_tick_table()
+        index = int(angle * self._index_scale + 0.5)
+        if 0 <= index < len(self.tick_table):
+            return self.servo_min_bound + angle * self._angle_scale, self.tick_table[index]
+
+        # outside of 0 to 180 degrees, work it out the long way
         if self.servo_min_bound != 0 or self.servo_max_bound != 180:
             angle = translate(angle, 0, 180, self.servo_min_bound, self.servo_max_bound)
-            self.currentAngle = angle
+        min_ticks = self.pwm.microseconds_to_ticks(self.min_pulse_us)
+        max_ticks = self.pwm.microseconds_to_ticks(self.max_pulse_us)
+        return angle, pulse_ticks(angle, min_ticks, max_ticks, self.angle_range)
 
-        duty_cycle = angle / 180
-        pulse_width = 548 * duty_cycle + 120
-        pulse_width = int(pulse_width)
+    def write_angle(self, angle=90, clock_start=0):
+        # writes the angle right away, without any waiting
+        self.currentAngle, pulse_width = self.pulse_width(angle)
 
         if 0 <= clock_start <= 4095:
-            pwm.set_pwm(self.channel, clock_start, pulse_width + clock_start)
+            self.pwm.set_pwm(self.channel, clock_start, pulse_width + clock_start)
             # pwm.set_pwm(channel, on , off) #on and off are 12-bit values so they are in between 0 and 4095
             # pwm.set_pwm_freq(freq) in hz
         else:
-            print("Invalid clock start time, resetting to zero...")
-            pwm.set_pwm(self.channel, 0, pulse_width)
-
-        if self.info_print:
-            print(
-                f"Setting Servo on channel {self.channel} to {self.currentAngle} "
-                f"on clock starting time {clock_start} and waiting {delay_amount} seconds")
-        time.sleep(delay_amount)
+            logger.warning("Invalid clock start time %s, resetting to zero...", clock_start)
+            self.pwm.set_pwm(self.channel, 0, pulse_width)
 
-    def glide_angle(self, starting_angle, ending_angle, time_to_take):
-        if self.info_print:
-            print(
-                f"Servo on channel {self.channel} gliding from angle {starting_angle} to {ending_angle} "
-                f"in {time_to_take} seconds")
-            self.info_print = False
-            gliding_info_print = True
-        else:
-            gliding_info_print = False
+    def set_angle(self, angle=90, delay_amount=0.3, clock_start=0):
+        if self.scheduler is not None:
+            return self._schedule_angle(angle, delay_amount, clock_start)
 
-        time_interval = time_to_take / abs((starting_angle - ending_angle))
+        self.write_angle(angle, clock_start)
+        log_move(self.info_print, self.channel,
+                 "Setting Servo on channel %s to %s on clock starting time %s and waiting %s seconds",
+                 self.channel, self.currentAngle, clock_start, delay_amount)
+        time.sleep(delay_amount)
 
-        self.set_angle(starting_angle, 0.5)
-        if starting_angle < ending_angle:
-            for angle_i in range(starting_angle + 1, ending_angle + 1):
-                self.set_angle(angle_i, time_interval)
-        else:
-            neg_angle = starting_angle - 1
-            while neg_angle != ending_angle:
-                neg_angle -= 1
-                self.set_angle(neg_angle, time_interval)
-        if gliding_info_print:
-            self.info_print = True
+    async def set_angle_async(self, angle=90, delay_amount=0.3, clock_start=0):
+        if self.scheduler is not None:
+            await wait_for_async(self._schedule_angle(angle, delay_amount, clock_start))
+            return
+
+        self.write_angle(angle, clock_start)
+        log_move(self.info_print, self.channel,
+                 "Setting Servo on channel %s to %s on clock starting time %s and waiting %s seconds",
+                 self.channel, self.currentAngle, clock_start, delay_amount)
+        await asyncio.sleep(delay_amount)
+
+    def _schedule_angle(self, angle, delay_amount, clock_start):
+        if not 0 <= clock_start <= 4095:
+            logger.warning("Invalid clock start time %s, resetting to zero...", clock_start)
+            clock_start = 0
+        log_move(self.info_print, self.channel,
+                 "Scheduling Servo on channel %s to %s on clock starting time %s and holding %s seconds",
+                 self.channel, angle, clock_start, delay_amount)
+        return self.scheduler.submit(self, angle, angle, 0, delay_amount, clock_start)
+
+    def glide_steps(self, starting_angle, ending_angle, time_to_take, update_rate=None, easing=None,
+                    max_acceleration=None):
+        # the glide as a routine generator, see run_steps
+        if self.scheduler is not None:
+            yield from handle_steps(self.scheduler.submit(self, starting_angle, ending_angle, time_to_take,
+                                                          easing=easing, max_acceleration=max_acceleration))
+            return
+
+        self.write_angle(starting_angle)
+        for angle, frame_time in glide_frames(starting_angle, ending_angle, time_to_take, update_rate, easing,
+                                             max_acceleration):
+            yield frame_time
+            self.write_angle(angle)
+
+    def glide_angle(self, starting_angle, ending_angle, time_to_take, update_rate=None, easing=None,
+                    max_acceleration=None):
+        log_move(self.info_print, self.channel, "Servo on channel %s gliding from angle %s to %s in %s seconds",
+                 self.channel, starting_angle, ending_angle, time_to_take)
+        if self.scheduler is not None:
+            return self.scheduler.submit(self, starting_angle, ending_angle, time_to_take,
+                                         easing=easing, max_acceleration=max_acceleration)
+
+        run_steps(self.glide_steps(starting_angle, ending_angle, time_to_take, update_rate, easing, max_acceleration))
+
+    async def glide_angle_async(self, starting_angle, ending_angle, time_to_take, update_rate=None, easing=None,
+                                max_acceleration=None):
+        log_move(self.info_print, self.channel, "Servo on channel %s gliding from angle %s to %s in %s seconds",
+                 self.channel, starting_angle, ending_angle, time_to_take)
+        if self.scheduler is not None:
+            await wait_for_async(self.scheduler.submit(self, starting_angle, ending_angle, time_to_take,
+                                                       easing=easing, max_acceleration=max_acceleration))
+            return
+
+        await run_steps_async(
+            self.glide_steps(starting_angle, ending_angle, time_to_take, update_rate, easing, max_acceleration))
 
     def random_angle(self, random_time=200):
         random_time = (random.randint(0, random_time)) / 1000.0
-        self.set_angle(random.randint(0, 180), random_time)
+        return self.set_angle(random.randint(0, 180), random_time)
 
-    def vibrate(self, start_at=0, interval=15, delay_amount=3, duration=100):
-        print("vibrate starting...")
-        start_time = time.time() * 1000
-        end_time = start_time
-        duration_millis = duration * 1000
-        for i in range(start_at, 180):
+    def vibrate_steps(self, start_at=0, interval=15, delay_amount=3, duration=100):
+        # flicks between 0 and start_at, start_at + interval, ... degrees, every position held for delay_amount
+        # seconds, until it gets to 180 degrees or the next flick would not fit into duration seconds
+        logger.info("vibrate starting...")
+        elapsed = 0.0
+        i = start_at
+        while i < 180 and elapsed + 2 * delay_amount <= duration:
             self.set_angle(0, 0)
-            time.sleep(delay_amount)
+            yield delay_amount
             self.set_angle(i, 0)
-            time.sleep(delay_amount)
+            yield delay_amount
             i += interval
-            if (end_time - start_time) <= duration_millis:
-                end_time = time.time() * 1000
-            else:
-                break
+            elapsed += 2 * delay_amount
 
         self.set_angle(0, 0)
-        print("vibrate ending...")
+        logger.info("vibrate ending...")
+
+    def vibrate(self, start_at=0, interval=15, delay_amount=3, duration=100):
+        run_steps(self.vibrate_steps(start_at, interval, delay_amount, duration))
+
+    async def vibrate_async(self, start_at=0, interval=15, delay_amount=3, duration=100):
+        await run_steps_async(self.vibrate_steps(start_at, interval, delay_amount, duration))
 
 
 class ServoGroup:
@@ -131,7 +479,8 @@ class ServoGroup:
     # on: The tick (between 0 and 4095) when the signal should transition from low to high
     # off:the tick (between 0 and 4095) when the signal should transition from high to low
 
-    def __init__(self, num_of_servos, *channels, current_angle="unknown", info_print=False):
+    def __init__(self, num_of_servos, *channels, current_angle="unknown", info_print=False, pwm_backend=None):
+        self.pwm = servo_backend(pwm_backend)
         self.currentAngle = current_angle
         self.info_print = info_print
         self.num_of_servos = num_of_servos
@@ -147,409 +496,446 @@ class ServoGroup:
 
     def set_angle(self, angle=90, delay_amount=1, clock_start=0):
         self.currentAngle = angle
-        duty_cycle = angle / 180
-        pulse_width = 548 * duty_cycle + 120
-        pulse_width = int(pulse_width)
-
-        if 0 <= clock_start <= 4095:
-            for channel in self.channels:
-                pwm.set_pwm(channel, clock_start, pulse_width + clock_start)
-                # pwm.set_pwm(channel, on , off) #on and off are 12-bit values so they are in between 0 and 4095
-                # pwm.set_pwm_freq(freq) in hz
-        else:
-            for channel in self.channels:
-                print("Invalid clock start time, resetting to zero...")
-                pwm.set_pwm(channel, 0, pulse_width)
-
-        if self.info_print:
-            print(
-                f"Setting servos on channels {self.channels} to {self.currentAngle} "
-                f"on clock starting time {clock_start}")
+        min_ticks = self.pwm.microseconds_to_ticks(servo_min_us)
+        max_ticks = self.pwm.microseconds_to_ticks(servo_max_us)
+        table = tick_table(0, 180, angle_resolution, min_ticks, max_ticks)
+        index = int(angle / angle_resolution + 0.5)
+        pulse_width = table[index] if 0 <= index < len(table) else pulse_ticks(angle, min_ticks, max_ticks)
+
+        if not 0 <= clock_start <= 4095:
+            logger.warning("Invalid clock start time %s, resetting to zero...", clock_start)
+            clock_start = 0
+        # all channels are written together in as few block writes as possible
+        self.pwm.set_multiple_pwm({channel: (clock_start, pulse_width + clock_start) for channel in self.channels})
+
+        log_move(self.info_print, self.channels, "Setting servos on channels %s to %s on clock starting time %s",
+                 self.channels, self.currentAngle, clock_start)
         time.sleep(delay_amount)
 
 
 class ServoGroup2:
-    def __init__(self, list_of_servos, info_print=False):
+    def __init__(self, list_of_servos, info_print=False, pwm_backend=None, scheduler=None):
         self.info_print = info_print
         self.list_of_servos = list_of_servos
-        if self.info_print:
-            print(f"Initiating Servo Group with {len(list_of_servos)} members")
+        # with a MotionScheduler the whole group is submitted at once and a handle is returned instead of sleeping
+        self.scheduler = scheduler
+        if pwm_backend is not None:
+            # wire every member onto the given backend
+            for servo in self.list_of_servos:
+                servo.pwm = servo_backend(pwm_backend)
+        log_move(self.info_print, None, "Initiating Servo Group with %s members", len(list_of_servos))
+
+    def write_angle(self, angle=90, clock_start=0):
+        # writes the angle to every member right away, without any waiting
+        if not 0 <= clock_start <= 4095:
+            logger.warning("Invalid clock start time %s, resetting to zero...", clock_start)
+            clock_start = 0
+        # every servo's ticks are collected first and then written together in as few block writes as possible
+        servo_ticks = []
+        for servo in self.list_of_servos:
+            servo.currentAngle, pulse_width = servo.pulse_width(angle)
+            servo_ticks.append((servo, (clock_start, pulse_width + clock_start)))
+        set_servo_pwms(servo_ticks)
 
     def set_angle(self, angle=90, delay_amount=1.0, clock_start=0):
-        info_print_list = []
-        if self.info_print:
-            print(f"Setting Servo Group to {angle} and waiting {delay_amount} seconds")
-
-        for i in range(0, len(self.list_of_servos)):
-            if self.list_of_servos[i].info_print:
-                self.list_of_servos[i].set_info_print(False)
-                info_print_list.append(i)
-            else:
-                info_print_list.append(-1)
-            self.list_of_servos[i].set_angle(angle, 0, clock_start)
-        if self.info_print:
-            for i in range(0, len(self.list_of_servos)):
-                if i == info_print_list[i]:
-                    self.list_of_servos[i].set_info_print(True)
+        log_move(self.info_print, self, "Setting Servo Group to %s and waiting %s seconds", angle, delay_amount)
+        if self.scheduler is not None:
+            return self._schedule_angle(angle, delay_amount, clock_start)
 
+        self.write_angle(angle, clock_start)
         time.sleep(delay_amount)
 
-    def glide_angle(self, starting_angle, ending_angle, time_to_take):
-        if self.info_print:
-            print(
-                f"ServoGroup gliding from angle {starting_angle} to {ending_angle} in {time_to_take} seconds")
-            self.info_print = False
-            gliding_info_print = True
-        else:
-            gliding_info_print = False
-
-        time_interval = time_to_take / abs((starting_angle - ending_angle))
-        self.set_angle(starting_angle, 0.5)
-        if starting_angle < ending_angle:
-            for angle_i in range(starting_angle + 1, ending_angle + 1):
-                self.set_angle(angle_i, time_interval)
-        else:
-            neg_angle = starting_angle - 1
-            while neg_angle != ending_angle:
-                neg_angle -= 1
-                self.set_angle(neg_angle, time_interval)
-        if gliding_info_print:
-            self.info_print = True
+    async def set_angle_async(self, angle=90, delay_amount=1.0, clock_start=0):
+        log_move(self.info_print, self, "Setting Servo Group to %s and waiting %s seconds", angle, delay_amount)
+        if self.scheduler is not None:
+            await wait_for_async(self._schedule_angle(angle, delay_amount, clock_start))
+            return
+
+        self.write_angle(angle, clock_start)
+        await asyncio.sleep(delay_amount)
+
+    def _schedule_angle(self, angle, delay_amount, clock_start):
+        if not 0 <= clock_start <= 4095:
+            logger.warning("Invalid clock start time %s, resetting to zero...", clock_start)
+            clock_start = 0
+        return self.scheduler.submit_group(self.list_of_servos, angle, angle, 0, delay_amount, clock_start)
+
+    def glide_steps(self, starting_angle, ending_angle, time_to_take, update_rate=None, easing=None,
+                    max_acceleration=None):
+        # the glide as a routine generator, see run_steps
+        if self.scheduler is not None:
+            yield from handle_steps(
+                self.scheduler.submit_group(self.list_of_servos, starting_angle, ending_angle, time_to_take,
+                                            easing=easing, max_acceleration=max_acceleration))
+            return
+
+        self.write_angle(starting_angle)
+        for angle, frame_time in glide_frames(starting_angle, ending_angle, time_to_take, update_rate, easing,
+                                             max_acceleration):
+            yield frame_time
+            self.write_angle(angle)
+
+    def glide_angle(self, starting_angle, ending_angle, time_to_take, update_rate=None, easing=None,
+                    max_acceleration=None):
+        log_move(self.info_print, self, "ServoGroup gliding from angle %s to %s in %s seconds",
+                 starting_angle, ending_angle, time_to_take)
+        if self.scheduler is not None:
+            return self.scheduler.submit_group(self.list_of_servos, starting_angle, ending_angle, time_to_take,
+                                               easing=easing, max_acceleration=max_acceleration)
+
+        run_steps(self.glide_steps(starting_angle, ending_angle, time_to_take, update_rate, easing, max_acceleration))
+
+    async def glide_angle_async(self, starting_angle, ending_angle, time_to_take, update_rate=None, easing=None,
+                                max_acceleration=None):
+        log_move(self.info_print, self, "ServoGroup gliding from angle %s to %s in %s seconds",
+                 starting_angle, ending_angle, time_to_take)
+        if self.scheduler is not None:
+            await wait_for_async(
+                self.scheduler.submit_group(self.list_of_servos, starting_angle, ending_angle, time_to_take,
+                                            easing=easing, max_acceleration=max_acceleration))
+            return
+
+        await run_steps_async(
+            self.glide_steps(starting_angle, ending_angle, time_to_take, update_rate, easing, max_acceleration))
+
+
+# Where the eyes of the original pumpkin sit: eye0-eye3 are the top row and eye4-eye7 the bottom row,
+# both from left to right. Every eye is (row, column, orientation, look[, ladder]), see EyeLayout.
+PUMPKIN_LAYOUT = [
+    (0, 0, 1, 1), (0, 1, 1, 1), (0, 2, 1, -1), (0, 3, -1, -1),
+    (1, 0, 1, 1), (1, 1, -1, 1, 1), (1, 2, -1, 1, 1), (1, 3, -1, 1, 1),
+]
+
+
+class EyeLayout:
+    # The grid a pumpkin's eyes are arranged in and which way every eye is mounted, eye n is declared as
+    # (row, column, orientation), (row, column, orientation, look) or (row, column, orientation, look, ladder):
+    #   row, column   its place on the grid, row 0 is the top row and column 0 the leftmost column
+    #   orientation   1 when the eye looks out at 180 degrees and in at 0, -1 when it is mounted the other way
+    #   look          1 or -1, eyes with the same look turn the same way when set to the same angle (defaults to 1)
+    #   ladder        1 when the eye climbs the ladders from 0 degrees, -1 from 180 (defaults to orientation)
+    # The routines are worked out from this as whole frames: one angle per eye, or None for an eye that is left
+    # where it is, so they work for any number of eyes.
+
+    def __init__(self, positions):
+        self.positions = [self._position(*position) for position in positions]
+        self.out_angles = [180 if orientation > 0 else 0 for _, _, orientation, _, _ in self.positions]
+        self.in_angles = [180 - angle for angle in self.out_angles]
+        self.look_angles = [0 if look > 0 else 180 for _, _, _, look, _ in self.positions]
+        self.ladder_signs = [ladder for _, _, _, _, ladder in self.positions]
+        # the eyes of every row from left to right and of every column from top to bottom
+        self.rows = self._lines(0, 1)
+        self.columns = self._lines(1, 0)
+
+    @staticmethod
+    def _position(row, column, orientation, look=1, ladder=None):
+        return row, column, orientation, look, orientation if ladder is None else ladder
+
+    @classmethod
+    def grid(cls, num_eyes, num_rows=2):
+        # eyes filling num_rows rows from left to right, all mounted the same way
+        num_columns = -(-num_eyes // num_rows)
+        return cls([(eye // num_columns, eye % num_columns, 1) for eye in range(num_eyes)])
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _lines(self, key, order):
+        lines = {}
+        for eye, position in enumerate(self.positions):
+            lines.setdefault(position[key], []).append(eye)
+        return [sorted(lines[line], key=lambda eye: self.positions[eye][order]) for line in sorted(lines)]
+
+    def frame(self, angles, eyes=None):
+        # a frame with eyes (all of them by default) at their angle out of angles and the other eyes left alone
+        if eyes is None:
+            return list(angles)
+        frame = [None] * len(self.positions)
+        for eye in eyes:
+            frame[eye] = angles[eye]
+        return frame
+
+    def looking_in(self, eyes=None):
+        return self.frame(self.in_angles, eyes)
+
+    def looking_out(self, eyes=None):
+        return self.frame(self.out_angles, eyes)
+
+    def looking_side(self, side, eyes=None):
+        # side 0 turns every eye one way and side 1 the other way
+        angles = self.look_angles if side == 0 else [180 - angle for angle in self.look_angles]
+        return self.frame(angles, eyes)
+
+    def ladder(self, angle):
+        # every eye angle degrees up its ladder, ladder(0) is the bottom of it
+        return [angle if sign > 0 else 180 - angle for sign in self.ladder_signs]
+
+    def halves(self):
+        # the eyes of the left and the right half, a middle column goes with the left half
+        split = (len(self.columns) + 1) // 2
+        return ([eye for column in self.columns[:split] for eye in column],
+                [eye for column in self.columns[split:] for eye in column])
+
+    def column_pairs(self):
+        # the outermost columns together, then the next ones in, until they meet in the middle
+        pairs = []
+        for left in range((len(self.columns) + 1) // 2):
+            right = len(self.columns) - 1 - left
+            pairs.append(self.columns[left] + (self.columns[right] if right != left else []))
+        return pairs
+
+    def ring(self):
+        # every eye once, along the rows with every other row backwards, so neighbours follow each other
+        return [eye for row_number, row in enumerate(self.rows) for eye in (row[::-1] if row_number % 2 else row)]
 
 
 class ServoPumpkin:
-    def __init__(self, eye0, eye1, eye2, eye3, eye4, eye5, eye6, eye7):
-        self.eye1 = eye1
-        self.eye0 = eye0
-        self.eye2 = eye2
-        self.eye3 = eye3
-        self.eye4 = eye4
-        self.eye5 = eye5
-        self.eye6 = eye6
-        self.eye7 = eye7
+    def __init__(self, *eyes, layout=None, pwm_backend=None):
+        # layout is an EyeLayout or a list with a (row, column, orientation[, look[, ladder]]) per eye, eight eyes default
+        # to PUMPKIN_LAYOUT and any other number to two rows of eyes all mounted the same way
+        if pwm_backend is not None:
+            # wire every eye onto the given backend
+            for eye in eyes:
+                eye.pwm = servo_backend(pwm_backend)
+        self.eyes = eyes
+        if layout is None:
+            layout = PUMPKIN_LAYOUT if len(eyes) == len(PUMPKIN_LAYOUT) else EyeLayout.grid(len(eyes))
+        self.layout = layout if isinstance(layout, EyeLayout) else EyeLayout(layout)
+        if len(self.layout) != len(eyes):
+            raise ValueError(f"The layout has {len(self.layout)} eyes but the pumpkin was given {len(eyes)}")
+
+    def write_frame(self, angles):
+        # sets every eye to its angle out of angles (None leaves it alone) in one bulk write per backend
+        servo_ticks = []
+        for eye, angle in zip(self.eyes, angles):
+            if angle is not None:
+                eye.currentAngle, pulse_width = eye.pulse_width(angle)
+                servo_ticks.append((eye, (0, pulse_width)))
+        set_servo_pwms(servo_ticks)
+        log_move(False, self, "Setting pumpkin eyes to %s", angles)
+
+    def pulse_steps(self, frames, delay_amount):
+        # writes every frame and holds it for delay_amount seconds
+        for frame in frames:
+            self.write_frame(frame)
+            yield delay_amount
+
+    # Every routine is written once as a generator (see run_steps) and can be run either blocking,
+    # eg. pumpkin.rows(), or on an asyncio event loop, eg. await pumpkin.rows_async()
+
+    def reset_out_steps(self, delay_amount=2):
+        self.write_frame(self.layout.looking_out())
+        yield delay_amount
 
     def reset_out(self, delay_amount=2):
-        self.eye0.set_angle(180, 0)
-        self.eye1.set_angle(180, 0)
-        self.eye2.set_angle(180, 0)
-        self.eye3.set_angle(0, 0)
-        self.eye4.set_angle(180, 0)
-        self.eye5.set_angle(0, 0)
-        self.eye6.set_angle(0, 0)
-        self.eye7.set_angle(0, 0)
-        time.sleep(delay_amount)
-
-    def random_eyes(self, duration, random_time=200):  # give duration of running in seconds
-        print("pumpkin random starting...")
-        start_time = time.time() * 1000
-        end_time = start_time
-        duration_millis = duration * 1000
-        while (end_time - start_time) <= duration_millis:
-            self.eye0.random_angle(random_time)
-            self.eye1.random_angle(random_time)
-            self.eye2.random_angle(random_time)
-            self.eye3.random_angle(random_time)
-            self.eye4.random_angle(random_time)
-            self.eye5.random_angle(random_time)
-            self.eye6.random_angle(random_time)
-            self.eye7.random_angle(random_time)
-
-            end_time = time.time() * 1000
-
-        print("pumpkin random ending...")
-
-    def min_max(self, duration, delay_amount=1):  # give duration of running in seconds
-        print("pumpkin min_max starting...")
-        start_time = time.time() * 1000
-        end_time = start_time
-        duration_millis = duration * 1000
-        while (end_time - start_time) <= duration_millis:
-            time.sleep(delay_amount)
-            self.eye0.set_angle(0, 0)
-            self.eye1.set_angle(0, 0)
-            self.eye2.set_angle(0, 0)
-            self.eye3.set_angle(180, 0)
-            self.eye4.set_angle(0, 0)
-            self.eye5.set_angle(180, 0)
-            self.eye6.set_angle(180, 0)
-            self.eye7.set_angle(180, 0)
-
-            time.sleep(delay_amount)
-
-            self.eye0.set_angle(180, 0)
-            self.eye1.set_angle(180, 0)
-            self.eye2.set_angle(180, 0)
-            self.eye3.set_angle(0, 0)
-            self.eye4.set_angle(180, 0)
-            self.eye5.set_angle(0, 0)
-            self.eye6.set_angle(0, 0)
-            self.eye7.set_angle(0, 0)
-
-            end_time = time.time() * 1000
-
-        print("pumpkin min_max ending...")
-
-    def min_max_glide(self, eye_speed, delay_amount=0.5):
-        self.reset_out(4)
-        print("pumpkin min_max_glide starting...")
-        if eye_speed >= 0.3:
-            self.eye0.glide_angle(180, 0, eye_speed)
-            self.eye1.glide_angle(180, 0, eye_speed)
-            self.eye2.glide_angle(180, 0, eye_speed)
-            self.eye3.glide_angle(0, 180, eye_speed)
-            self.eye7.glide_angle(0, 180, eye_speed)
-            self.eye6.glide_angle(0, 180, eye_speed)
-            self.eye5.glide_angle(0, 180, eye_speed)
-            self.eye4.glide_angle(180, 0, eye_speed)
-
-            time.sleep(delay_amount)
-
-            self.eye4.glide_angle(0, 180, eye_speed)
-            self.eye5.glide_angle(180, 0, eye_speed)
-            self.eye6.glide_angle(180, 0, eye_speed)
-            self.eye7.glide_angle(180, 0, eye_speed)
-            self.eye3.glide_angle(180, 0, eye_speed)
-            self.eye2.glide_angle(0, 180, eye_speed)
-            self.eye1.glide_angle(0, 180, eye_speed)
-            self.eye0.glide_angle(0, 180, eye_speed)
-        else:
-            self.eye0.set_angle(0, eye_speed)
-            self.eye1.set_angle(0, eye_speed)
-            self.eye2.set_angle(0, eye_speed)
-            self.eye3.set_angle(180, eye_speed)
-            self.eye7.set_angle(180, eye_speed)
-            self.eye6.set_angle(180, eye_speed)
-            self.eye5.set_angle(180, eye_speed)
-            self.eye4.set_angle(0, eye_speed)
-
-            time.sleep(delay_amount)
-
-            self.eye4.set_angle(180, eye_speed)
-            self.eye5.set_angle(0, eye_speed)
-            self.eye6.set_angle(0, eye_speed)
-            self.eye7.set_angle(0, eye_speed)
-            self.eye3.set_angle(0, eye_speed)
-            self.eye2.set_angle(180, eye_speed)
-            self.eye1.set_angle(180, eye_speed)
-            self.eye0.set_angle(180, eye_speed)
-
-        print("pumpkin min_max_glide ending...")
+        run_steps(self.reset_out_steps(delay_amount))
+
+    async def reset_out_async(self, delay_amount=2):
+        await run_steps_async(self.reset_out_steps(delay_amount))
+
+    def random_eyes_steps(self, duration, random_time=200, seed=None):  # give duration of running in seconds
+        # Every eye looks somewhere random and then waits up to random_time ms before its next look, each eye on
+        # its own timer. The next looks of all eyes are kept in a heap by time, and eyes that are due within
+        # one servo period of each other are moved together in one write, since the servos could not tell
+        # them apart anyway. With a seed the eyes do the same every time, otherwise they use the random module.
+        rng = random.Random(seed) if seed is not None else random
+        period = 1.0 / servo_frequency
+        logger.info("pumpkin random starting...")
+        now = 0.0
+        next_looks = [(0.0, eye) for eye in range(len(self.eyes))]
+        while next_looks and next_looks[0][0] <= duration:
+            yield next_looks[0][0] - now
+            now = next_looks[0][0]
+            frame = [None] * len(self.eyes)
+            while next_looks and next_looks[0][0] < now + period:
+                frame[heapq.heappop(next_looks)[1]] = rng.randint(0, 180)
+            self.write_frame(frame)
+            for eye, angle in enumerate(frame):
+                if angle is not None:
+                    # never sooner than the next period, a wait of 0 would keep the eye moving on the spot
+                    wait = max(rng.randint(0, random_time) / 1000.0, period)
+                    heapq.heappush(next_looks, (now + wait, eye))
+
+        logger.info("pumpkin random ending...")
+
+    def random_eyes(self, duration, random_time=200, seed=None):
+        run_steps(self.random_eyes_steps(duration, random_time, seed))
+
+    async def random_eyes_async(self, duration, random_time=200, seed=None):
+        await run_steps_async(self.random_eyes_steps(duration, random_time, seed))
+
+    def min_max_steps(self, duration, delay_amount=1):  # give duration of running in seconds
+        logger.info("pumpkin min_max starting...")
+        looking_in, looking_out = self.layout.looking_in(), self.layout.looking_out()
+        elapsed = 0.0
+        while elapsed <= duration:
+            yield delay_amount
+            self.write_frame(looking_in)
+            yield delay_amount
+            self.write_frame(looking_out)
+            elapsed += 2 * delay_amount
+
+        logger.info("pumpkin min_max ending...")
+
+    def min_max(self, duration, delay_amount=1):
+        run_steps(self.min_max_steps(duration, delay_amount))
+
+    async def min_max_async(self, duration, delay_amount=1):
+        await run_steps_async(self.min_max_steps(duration, delay_amount))
+
+    def min_max_glide_steps(self, eye_speed, delay_amount=0.5, easing="ease_in_out"):
+        # One eye after the other looks in, going round the pumpkin, and then back out the other way round.
+        # From 0.3 seconds per eye up they glide, easing in and out so they do not jerk at either end.
+        yield from self.reset_out_steps(4)
+        logger.info("pumpkin min_max_glide starting...")
+        ring = self.layout.ring()
+        yield from self._eye_by_eye_steps(ring, self.layout.out_angles, self.layout.in_angles, eye_speed, easing)
+        yield delay_amount
+        yield from self._eye_by_eye_steps(ring[::-1], self.layout.in_angles, self.layout.out_angles, eye_speed,
+                                          easing)
+        logger.info("pumpkin min_max_glide ending...")
+
+    def _eye_by_eye_steps(self, order, starting_angles, ending_angles, eye_speed, easing):
+        for eye in order:
+            if eye_speed >= 0.3:
+                yield from self.eyes[eye].glide_steps(starting_angles[eye], ending_angles[eye], eye_speed,
+                                                      easing=easing)
+            else:
+                self.eyes[eye].write_angle(ending_angles[eye])
+                yield eye_speed
+
+    def min_max_glide(self, eye_speed, delay_amount=0.5, easing="ease_in_out"):
+        run_steps(self.min_max_glide_steps(eye_speed, delay_amount, easing))
+
+    async def min_max_glide_async(self, eye_speed, delay_amount=0.5, easing="ease_in_out"):
+        await run_steps_async(self.min_max_glide_steps(eye_speed, delay_amount, easing))
+
+    def half_half_steps(self, delay_amount=1):
+        yield from self.reset_out_steps()
+        logger.info("Half_Half starting...")
+        # the left half looks in and out, then the right half
+        frames = []
+        for half in self.layout.halves():
+            frames += [self.layout.looking_in(half), self.layout.looking_out(half)]
+        yield from self.pulse_steps(frames[:-1], delay_amount)
+        self.write_frame(frames[-1])
+        logger.info("Half_Half ending...")
 
     def half_half(self, delay_amount=1):
-        self.reset_out()
-        print("Half_Half starting...")
+        run_steps(self.half_half_steps(delay_amount))
 
-        # start half half
-        self.eye0.set_angle(0, 0)
-        self.eye1.set_angle(0, 0)
-        self.eye4.set_angle(0, 0)
-        self.eye5.set_angle(180, 0)
+    async def half_half_async(self, delay_amount=1):
+        await run_steps_async(self.half_half_steps(delay_amount))
 
-        time.sleep(delay_amount)
-
-        self.eye0.set_angle(180, 0)
-        self.eye1.set_angle(180, 0)
-        self.eye4.set_angle(180, 0)
-        self.eye5.set_angle(0, 0)
-
-        time.sleep(delay_amount)
-        self.eye2.set_angle(0, 0)
-        self.eye3.set_angle(180, 0)
-        self.eye6.set_angle(180, 0)
-        self.eye7.set_angle(180, 0)
-
-        time.sleep(delay_amount)
-
-        self.eye2.set_angle(180, 0)
-        self.eye3.set_angle(0, 0)
-        self.eye6.set_angle(0, 0)
-        self.eye7.set_angle(0, 0)
-
-        print("Half_Half ending...")
+    def columns_steps(self, delay_amount=1):
+        yield from self.reset_out_steps()
+        logger.info("columns starting...")
+        # each column looks in and out in turn, from left to right
+        for column in self.layout.columns:
+            yield from self.pulse_steps([self.layout.looking_in(column), self.layout.looking_out(column)],
+                                        delay_amount)
+        logger.info("columns ending...")
 
     def columns(self, delay_amount=1):
-        self.reset_out()
-        print("columns starting...")
-        # start each column is a group
+        run_steps(self.columns_steps(delay_amount))
 
-        # column 1:
-        self.eye0.set_angle(0, 0)
-        self.eye4.set_angle(0, 0)
-        time.sleep(delay_amount)
-        self.eye0.set_angle(180, 0)
-        self.eye4.set_angle(180, 0)
-        time.sleep(delay_amount)
-
-        # column 2:
-        self.eye1.set_angle(0, 0)
-        self.eye5.set_angle(180, 0)
-        time.sleep(delay_amount)
-        self.eye1.set_angle(180, 0)
-        self.eye5.set_angle(0, 0)
-        time.sleep(delay_amount)
-
-        # column 3:
-        self.eye2.set_angle(0, 0)
-        self.eye6.set_angle(180, 0)
-        time.sleep(delay_amount)
-        self.eye2.set_angle(180, 0)
-        self.eye6.set_angle(0, 0)
-        time.sleep(delay_amount)
-
-        # column 4:
-        self.eye3.set_angle(180, 0)
-        self.eye7.set_angle(180, 0)
-        time.sleep(delay_amount)
-        self.eye3.set_angle(0, 0)
-        self.eye7.set_angle(0, 0)
-        time.sleep(delay_amount)
+    async def columns_async(self, delay_amount=1):
+        await run_steps_async(self.columns_steps(delay_amount))
 
-        print("columns ending...")
+    def columns_converging_steps(self, delay_amount=1):
+        yield from self.reset_out_steps()
+        logger.info("columns converging starting...")
+        # the outermost columns look in and out together, then the next ones in towards the middle
+        for columns in self.layout.column_pairs():
+            yield from self.pulse_steps([self.layout.looking_in(columns), self.layout.looking_out(columns)],
+                                        delay_amount)
+        logger.info("columns converging ending...")
 
     def columns_converging(self, delay_amount=1):
-        self.reset_out()
-        print("columns converging starting...")
-        # start each column is a group
-
-        # column 1:
-        self.eye0.set_angle(0, 0)
-        self.eye4.set_angle(0, 0)
-        # column 4:
-        self.eye3.set_angle(180, 0)
-        self.eye7.set_angle(180, 0)
-        time.sleep(delay_amount)
-        self.eye0.set_angle(180, 0)
-        self.eye4.set_angle(180, 0)
-        self.eye3.set_angle(0, 0)
-        self.eye7.set_angle(0, 0)
-        time.sleep(delay_amount)
+        run_steps(self.columns_converging_steps(delay_amount))
 
-        # column 2:
-        self.eye1.set_angle(0, 0)
-        self.eye5.set_angle(180, 0)
-        # column 3:
-        self.eye2.set_angle(0, 0)
-        self.eye6.set_angle(180, 0)
-        time.sleep(delay_amount)
-        self.eye1.set_angle(180, 0)
-        self.eye5.set_angle(0, 0)
-        self.eye2.set_angle(180, 0)
-        self.eye6.set_angle(0, 0)
-        time.sleep(delay_amount)
+    async def columns_converging_async(self, delay_amount=1):
+        await run_steps_async(self.columns_converging_steps(delay_amount))
 
-        print("columns converging ending...")
+    def rows_steps(self, delay_amount=1):
+        yield from self.reset_out_steps()
+        logger.info("rows starting...")
+        # each row looks in and out in turn, from the top down
+        for row in self.layout.rows:
+            yield from self.pulse_steps([self.layout.looking_in(row), self.layout.looking_out(row)], delay_amount)
+        logger.info("rows ending...")
 
     def rows(self, delay_amount=1):
-        self.reset_out()
-        print("rows starting...")
-        # start each row is a group
-
-        # top row:
-        self.eye0.set_angle(0, 0)
-        self.eye1.set_angle(0, 0)
-        self.eye2.set_angle(0, 0)
-        self.eye3.set_angle(180, 0)
-        time.sleep(delay_amount)
-        self.eye0.set_angle(180, 0)
-        self.eye1.set_angle(180, 0)
-        self.eye2.set_angle(180, 0)
-        self.eye3.set_angle(0, 0)
-        time.sleep(delay_amount)
+        run_steps(self.rows_steps(delay_amount))
 
-        # bottom row:
-        self.eye4.set_angle(0, 0)
-        self.eye5.set_angle(180, 0)
-        self.eye6.set_angle(180, 0)
-        self.eye7.set_angle(180, 0)
-        time.sleep(delay_amount)
-        self.eye4.set_angle(180, 0)
-        self.eye5.set_angle(0, 0)
-        self.eye6.set_angle(0, 0)
-        self.eye7.set_angle(0, 0)
-        time.sleep(delay_amount)
-        print("rows ending...")
+    async def rows_async(self, delay_amount=1):
+        await run_steps_async(self.rows_steps(delay_amount))
+
+    def look_directions_steps(self, delay_amount=1):
+        yield from self.reset_out_steps()
+        logger.info("look_directions starting...")
+        # every row looks one way and then the other, from the bottom up
+        for row in reversed(self.layout.rows):
+            yield from self.pulse_steps([self.layout.looking_side(0, row), self.layout.looking_side(1, row)],
+                                        delay_amount)
+        logger.info("look_directions ending...")
 
     def look_directions(self, delay_amount=1):
-        self.reset_out()
-        print("look_directions starting...")
-        # start bottom halves at same time
-        self.eye4.set_angle(0, 0)  # inward
-        self.eye5.set_angle(0, 0)  # inward
-        self.eye6.set_angle(0, 0)  # outward
-        self.eye7.set_angle(0, 0)  # outward
-        time.sleep(delay_amount)
-        self.eye4.set_angle(180, 0)  # outward
-        self.eye5.set_angle(180, 0)  # outward
-        self.eye6.set_angle(180, 0)  # inward
-        self.eye7.set_angle(180, 0)  # inward
-        time.sleep(delay_amount)
+        run_steps(self.look_directions_steps(delay_amount))
 
-        # start top halves at same time
-        self.eye0.set_angle(0, 0)  # inward
-        self.eye1.set_angle(0, 0)  # inward
-        self.eye2.set_angle(180, 0)  # outward
-        self.eye3.set_angle(180, 0)  # outward
-        time.sleep(delay_amount)
-        self.eye0.set_angle(180, 0)  # outward
-        self.eye1.set_angle(180, 0)  # outward
-        self.eye2.set_angle(0, 0)  # inward
-        self.eye3.set_angle(0, 0)  # inward
-        time.sleep(delay_amount)
-        print("look_directions ending...")
+    async def look_directions_async(self, delay_amount=1):
+        await run_steps_async(self.look_directions_steps(delay_amount))
 
-    def ladders(self, start_at, interval=15, delay_amount=3.0, duration=100):
-        print("ladders starting...")
-        start_time = time.time() * 1000
-        end_time = start_time
-        duration_millis = duration * 1000
+    def ladders_steps(self, start_at, interval=15, delay_amount=3.0, duration=100):
+        logger.info("ladders starting...")
+        # every eye flicks between looking in and start_at, start_at + interval, ... degrees further out
+        bottom = self.layout.ladder(0)
+        elapsed = 0.0
         i = start_at
         while i <= 180:
-            self.eye0.set_angle(0, 0)
-            self.eye1.set_angle(0, 0)
-            self.eye2.set_angle(0, 0)
-            self.eye3.set_angle(180, 0)
-            self.eye4.set_angle(0, 0)
-            self.eye5.set_angle(0, 0)
-            self.eye6.set_angle(0, 0)
-            self.eye7.set_angle(0, 0)
-            time.sleep(delay_amount)
-            self.eye0.set_angle(i, 0)
-            self.eye1.set_angle(i, 0)
-            self.eye2.set_angle(i, 0)
-            self.eye3.set_angle(abs(i - 180), 0)
-            self.eye4.set_angle(i, 0)
-            self.eye5.set_angle(i, 0)
-            self.eye6.set_angle(i, 0)
-            self.eye7.set_angle(i, 0)
-            time.sleep(delay_amount)
+            yield from self.pulse_steps([bottom, self.layout.ladder(i)], delay_amount)
             i += interval
-            if (end_time - start_time) <= duration_millis:
-                end_time = time.time() * 1000
+            if elapsed <= duration:
+                elapsed += 2 * delay_amount
             else:
                 break
 
-        self.eye0.set_angle(0, 0)
-        self.eye1.set_angle(0, 0)
-        self.eye2.set_angle(0, 0)
-        self.eye3.set_angle(180, 0)
-        self.eye4.set_angle(0, 0)
-        self.eye5.set_angle(0, 0)
-        self.eye6.set_angle(0, 0)
-        self.eye7.set_angle(0, 0)
-        print("ladders ending...")
-
-    def vibrate_rounds(self):
-        self.eye0.vibrate(30, 1, 0.05, 1)
-        self.eye1.vibrate(30, 1, 0.05, 1)
-        self.eye2.vibrate(30, 1, 0.05, 1)
-        self.eye3.vibrate(30, 1, 0.05, 1)
-        self.eye4.vibrate(30, 1, 0.05, 1)
-        self.eye5.vibrate(30, 1, 0.05, 1)
-        self.eye6.vibrate(30, 1, 0.05, 1)
-        self.eye7.vibrate(30, 1, 0.05, 1)
+        self.write_frame(bottom)
+        logger.info("ladders ending...")
+
+    def ladders(self, start_at, interval=15, delay_amount=3.0, duration=100):
+        run_steps(self.ladders_steps(start_at, interval, delay_amount, duration))
+
+    async def ladders_async(self, start_at, interval=15, delay_amount=3.0, duration=100):
+        await run_steps_async(self.ladders_steps(start_at, interval, delay_amount, duration))
+
+    def vibrate_rounds_steps(self, duration=1, frequency=10, amplitude=15, waveform="square"):
+        # Every eye vibrates between the bottom of its ladder and 2 * amplitude degrees up it for duration
+        # seconds, all at once but each a little later than the one before it going round the pumpkin.
+        # frequency is in vibrations per second, waveform is one of oscillators.waveforms.
+        logger.info("vibrate rounds starting...")
+        ring = self.layout.ring()
+        bottom = self.layout.ladder(0)
+        centers = self.layout.ladder(amplitude)
+        eye_oscillators = [None] * len(self.eyes)
+        for position, eye in enumerate(ring):
+            # swinging towards the bottom first, which is up for some eyes and down for the others
+            swing = bottom[eye] - centers[eye]
+            eye_oscillators[eye] = oscillators.Oscillator(waveform, frequency, swing, centers[eye], position / len(ring))
+        yield from oscillate_steps(self.eyes, eye_oscillators, duration)
+        self.write_frame(bottom)
+        logger.info("vibrate rounds ending...")
+
+    def vibrate_rounds(self, duration=1, frequency=10, amplitude=15, waveform="square"):
+        run_steps(self.vibrate_rounds_steps(duration, frequency, amplitude, waveform))
+
+    async def vibrate_rounds_async(self, duration=1, frequency=10, amplitude=15, waveform="square"):
+        await run_steps_async(self.vibrate_rounds_steps(duration, frequency, amplitude, waveform))
 
 
 if __name__ == "__main__":
+    # show what the routines are doing, from a background thread so the timing is not disturbed
+    setup_logging()
     top_left = Servo(0, 35, 82)
     top_mid_left = Servo(1, 137, 180)
     top_mid_right = Servo(2, 35, 84)
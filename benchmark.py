@@ -0,0 +1,182 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+from PCAde9685 import Servo, ServoGroup, ServoGroup2, ServoPumpkin, run_steps
+from pca9685_backends import SimulatedI2CBus, SimulatedPCA9685
+
+# Runs the routines against a simulated PCA9685 on a bus that takes as long as a real one and reports
+# what each of them costs:
+#   writes, bytes        I2C transactions and bytes put on the bus
+#   bus_time             seconds the bus was busy
+#   steps                number of times the routine waited (roughly one per frame of writes)
+#   requested_duration   the sum of the waits the routine asked for
+#   duration             how long it really took, timing_error is the difference
+#   cpu_time             CPU seconds spent in Python (sleeping and waiting for the bus not included)
+#   frame_rate           steps per second the routine could reach if it never waited, from cpu_time + bus_time
+#
+# python benchmark.py --output results.json
+# python benchmark.py --compare results.json     exits with 1 when something got worse by more than --threshold
+
+CLOCKS = (100000, 400000, 1000000)
+# metrics where bigger is worse, compared by --compare
+COMPARED_METRICS = ("writes", "bytes", "bus_time", "cpu_time")
+NUM_EYES = 8
+
+
+class Rig:
+    # a pumpkin and some groups on one simulated chip
+    def __init__(self, backend):
+        self.backend = backend
+        self.eyes = [Servo(channel, pwm_backend=backend) for channel in range(NUM_EYES)]
+        self.pumpkin = ServoPumpkin(*self.eyes)
+        self.group = ServoGroup(NUM_EYES, *range(NUM_EYES), pwm_backend=backend)
+        self.group2 = ServoGroup2(self.eyes)
+
+
+def set_angle_steps(target, frames=100):
+    # set_angle on every frame, swinging between both ends so every frame has to be written
+    for frame in range(frames):
+        target.set_angle(180 * (frame % 2), 0)
+        yield 0
+
+
+# short delays so the whole suite runs in about a minute per clock speed
+CASES = {
+    "reset_out": lambda rig: rig.pumpkin.reset_out_steps(0.05),
+    "random_eyes": lambda rig: rig.pumpkin.random_eyes_steps(1, 50),
+    "min_max": lambda rig: rig.pumpkin.min_max_steps(0.5, 0.05),
+    "min_max_glide": lambda rig: rig.pumpkin.min_max_glide_steps(0.3, 0.05),
+    "half_half": lambda rig: rig.pumpkin.half_half_steps(0.05),
+    "columns": lambda rig: rig.pumpkin.columns_steps(0.05),
+    "columns_converging": lambda rig: rig.pumpkin.columns_converging_steps(0.05),
+    "rows": lambda rig: rig.pumpkin.rows_steps(0.05),
+    "look_directions": lambda rig: rig.pumpkin.look_directions_steps(0.05),
+    "ladders": lambda rig: rig.pumpkin.ladders_steps(0, 10, 0.02, 1),
+    "vibrate_rounds": lambda rig: rig.pumpkin.vibrate_rounds_steps(),
+    "servo_group_set_angle": lambda rig: set_angle_steps(rig.group),
+    "servo_group2_set_angle": lambda rig: set_angle_steps(rig.group2),
+    "servo_glide_angle": lambda rig: rig.eyes[0].glide_steps(0, 180, 1),
+    "servo_group2_glide_angle": lambda rig: rig.group2.glide_steps(0, 180, 1),
+}
+
+
+def counted(steps, counts):
+    for delay_amount in steps:
+        counts["steps"] += 1
+        counts["requested_duration"] += delay_amount
+        yield delay_amount
+
+
+def run_case(name, clock_hz):
+    bus = SimulatedI2CBus(clock_hz, realtime=True)
+    backend = SimulatedPCA9685(bus=bus)
+    rig = Rig(backend)
+    # bring the chip up first so the start-up writes are not charged to the routine
+    backend.ensure_ready()
+    bus.reset_stats()
+    random.seed(0)
+
+    counts = {"steps": 0, "requested_duration": 0.0}
+    steps = counted(CASES[name](rig), counts)
+    wall_start = time.monotonic()
+    cpu_start = time.process_time()
+    run_steps(steps)
+    cpu_time = time.process_time() - cpu_start
+    duration = time.monotonic() - wall_start
+
+    busy_time = cpu_time + bus.bus_time
+    return {
+        "writes": bus.transactions,
+        "bytes": bus.bytes_sent,
+        "bus_time": bus.bus_time,
+        "steps": counts["steps"],
+        "requested_duration": counts["requested_duration"],
+        "duration": duration,
+        "timing_error": duration - counts["requested_duration"],
+        "cpu_time": cpu_time,
+        "frame_rate": counts["steps"] / busy_time if busy_time > 0 else None,
+    }
+
+
+def run_benchmarks(clocks=CLOCKS, names=None):
+    if names is None:
+        names = list(CASES)
+    results = {}
+    for clock_hz in clocks:
+        for name in names:
+            results.setdefault(str(clock_hz), {})[name] = run_case(name, clock_hz)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def print_results(report):
+    print(f"{'clock':>8} {'case':<26} {'writes':>7} {'bytes':>7} {'bus ms':>8} {'cpu ms':>8} "
+          f"{'error ms':>9} {'frames/s':>9}")
+    for clock_hz, cases in report["results"].items():
+        for name, result in cases.items():
+            frame_rate = f"{result['frame_rate']:9.0f}" if result["frame_rate"] is not None else f"{'-':>9}"
+            print(f"{clock_hz:>8} {name:<26} {result['writes']:>7} {result['bytes']:>7} "
+                  f"{result['bus_time'] * 1000:8.1f} {result['cpu_time'] * 1000:8.1f} "
+                  f"{result['timing_error'] * 1000:9.1f} {frame_rate}")
+
+
+def compare(baseline, report, threshold=0.1, min_time=0.005):
+    # prints every metric that changed by more than threshold (a fraction), returns the number that got worse
+    # times that moved by less than min_time seconds are left out, they are within the noise
+    regressions = 0
+    for clock_hz, cases in report["results"].items():
+        for name, result in cases.items():
+            old = baseline["results"].get(clock_hz, {}).get(name)
+            if old is None:
+                continue
+            for metric in COMPARED_METRICS:
+                before, after = old[metric], result[metric]
+                if before == after:
+                    continue
+                if metric.endswith("_time") and abs(after - before) < min_time:
+                    continue
+                change = (after - before) / before if before else float("inf")
+                if abs(change) <= threshold:
+                    continue
+                verdict = "worse" if change > 0 else "better"
+                if change > 0:
+                    regressions += 1
+                print(f"{clock_hz:>8} {name:<26} {metric:<10} {before:.6g} -> {after:.6g} ({change:+.0%}, {verdict})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the servo routines against a simulated PCA9685")
+    parser.add_argument("--clock", type=int, nargs="+", default=list(CLOCKS), help="I2C clock speeds in Hz")
+    parser.add_argument("--case", nargs="+", choices=list(CASES), help="only run these cases")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved earlier with --output")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fraction a metric has to change by to be reported by --compare")
+    parser.add_argument("--min-time", type=float, default=0.005,
+                        help="seconds a time has to change by to be reported by --compare")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.clock, args.case)
+    print_results(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"\nCompared to {args.compare} ({baseline['time']}):")
+        if compare(baseline, report, args.threshold, args.min_time):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
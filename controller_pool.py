@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from pca9685_backends import (ALL_LED_ON_L, ALLCALL_ADDRESS, NUM_CHANNELS, AdafruitBackend, SimulatedGroupAddress,
+                              SimulatedI2CBus, SimulatedPCA9685, tick_bytes)
+
+
+def simulated_boards(clock_hz=100000):
+    # a backend_factory for pools of simulated boards, boards with the same busnum share one simulated bus
+    buses = {}
+
+    def create_board(address=0x40, busnum=None):
+        if busnum not in buses:
+            buses[busnum] = SimulatedI2CBus(clock_hz)
+        if address == ALLCALL_ADDRESS:
+            return SimulatedGroupAddress(address, buses[busnum])
+        return SimulatedPCA9685(address, buses[busnum])
+
+    return create_board
+
+
+class ControllerPool:
+    # Several PCA9685 boards behind one set of global channel numbers: the first board added gets
+    # channels 0-15, the second 16-31 and so on. A pool can be handed to Servo, ServoGroup2 and
+    # ServoPumpkin as their pwm_backend, every write is routed to the board the channel lives on.
+    # A bulk write is split per board, and boards on different I2C buses are written in parallel.
+    # When every board on a bus ends up with the same ticks on all channels, the bus gets a single
+    # ALL_LED write to the ALLCALL address instead, which all of its boards latch at once.
+
+    def __init__(self, backend_factory=AdafruitBackend, stagger=False, allcall=True):
+        # backend_factory(address=..., busnum=...) creates the backend for a board, eg. simulated_boards()
+        # with stagger every board spreads the ON ticks of its channels over the period
+        # allcall assumes every PCA9685 on a bus with more than one board belongs to this pool
+        self.backend_factory = backend_factory
+        self.stagger = stagger
+        self.allcall = allcall
+        self.group_addresses = {}  # bus: backend writing to the bus's ALLCALL address
+        self.busnums = {}  # board backend: busnum it was added with
+        self.boards = []
+        self.frequency_hz = None
+        self.executor = None
+
+    def add_board(self, address=0x40, busnum=None, backend=None):
+        # returns the global channel number of the board's channel 0
+        if backend is None:
+            backend = self.backend_factory(address=address, busnum=busnum)
+        backend.stagger = self.stagger
+        self.busnums[backend] = busnum
+        if self.frequency_hz is not None:
+            backend.set_pwm_freq(self.frequency_hz)
+        self.boards.append(backend)
+        return (len(self.boards) - 1) * NUM_CHANNELS
+
+    def locate(self, channel):
+        # global channel -> (board backend, channel on that board)
+        board, local_channel = divmod(channel, NUM_CHANNELS)
+        if board >= len(self.boards):
+            raise ValueError(f"Channel {channel} is not on any board, the pool has {len(self.boards)} boards")
+        return self.boards[board], local_channel
+
+    def buses(self):
+        # {bus: [boards on it]}
+        buses = {}
+        for backend in self.boards:
+            buses.setdefault(backend.chip_key()[0], []).append(backend)
+        return buses
+
+    # the same interface as a single PWMBackend
+
+    def set_pwm_freq(self, freq_hz):
+        self.frequency_hz = freq_hz
+        for backend in self.boards:
+            backend.set_pwm_freq(freq_hz)
+
+    @property
+    def actual_frequency(self):
+        return self.boards[0].actual_frequency
+
+    def microseconds_to_ticks(self, microseconds):
+        # every board runs at the same frequency
+        return self.boards[0].microseconds_to_ticks(microseconds)
+
+    def invalidate_cache(self):
+        for backend in self.boards:
+            backend.invalidate_cache()
+
+    @property
+    def cache_hits(self):
+        return sum(backend.cache_hits for backend in self.boards)
+
+    @property
+    def cache_misses(self):
+        return sum(backend.cache_misses for backend in self.boards)
+
+    def set_pwm(self, channel, on, off):
+        backend, local_channel = self.locate(channel)
+        backend.set_pwm(local_channel, on, off)
+
+    def set_multiple_pwm(self, channel_ticks):
+        # channel_ticks is a dict of {global channel: (on, off)}
+        board_ticks = {}
+        for channel, ticks in channel_ticks.items():
+            backend, local_channel = self.locate(channel)
+            board_ticks.setdefault(backend, {})[local_channel] = ticks
+
+        bus_jobs = {}
+        for bus, boards in self.buses().items():
+            changes = [(backend, backend.pending_changes(board_ticks[backend]))
+                       for backend in boards if backend in board_ticks]
+            changes = [(backend, changed) for backend, changed in changes if changed]
+            if not changes:
+                continue
+            ticks = self._allcall_ticks(boards, changes)
+            if ticks is not None:
+                bus_jobs[bus] = [lambda bus=bus, boards=boards, changes=changes, ticks=ticks:
+                                 self._write_allcall(bus, boards, changes, ticks)]
+            else:
+                bus_jobs[bus] = [lambda backend=backend, changed=changed: backend.write_changes(changed)
+                                 for backend, changed in changes]
+        self._run_per_bus(bus_jobs)
+
+    def set_all_pwm(self, on, off):
+        self._run_per_bus({bus: [lambda backend=backend: backend.set_all_pwm(on, off) for backend in boards]
+                           for bus, boards in self.buses().items()})
+
+    def _allcall_ticks(self, boards, changes):
+        # the ticks when all boards on the bus (more than one) would end up with them on every channel
+        if not self.allcall or len(boards) < 2 or len(changes) < len(boards):
+            return None
+        ticks = {backend.broadcast_ticks(changed) for backend, changed in changes}
+        if len(ticks) != 1 or None in ticks:
+            return None
+        return ticks.pop()
+
+    def group_address(self, bus):
+        if bus not in self.group_addresses:
+            busnum = self.busnums[self.buses()[bus][0]]
+            self.group_addresses[bus] = self.backend_factory(address=ALLCALL_ADDRESS, busnum=busnum)
+        return self.group_addresses[bus]
+
+    def _write_allcall(self, bus, boards, changes, ticks):
+        for backend in boards:
+            if not backend.ready:
+                backend.ensure_ready()
+        self.group_address(bus).write_list(ALL_LED_ON_L, tick_bytes(*ticks))
+        for backend, changed in changes:
+            backend.cache_misses += len(changed)
+            backend.shadow = dict.fromkeys(range(NUM_CHANNELS), ticks)
+
+    def _run_per_bus(self, bus_jobs):
+        # {bus: [writes]}, the writes on one bus run one after the other, different buses at the same time
+        if len(bus_jobs) <= 1:
+            for jobs in bus_jobs.values():
+                for job in jobs:
+                    job()
+            return
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=len(self.buses()), thread_name_prefix="i2c-bus")
+
+        def run_bus(jobs):
+            for job in jobs:
+                job()
+
+        for future in [self.executor.submit(run_bus, jobs) for jobs in bus_jobs.values()]:
+            future.result()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
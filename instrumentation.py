@@ -0,0 +1,209 @@
+import os
+import time
+from array import array
+
+from pca9685_backends import ALL_LED_OFF_H, ALL_LED_ON_L, LED0_ON_L, NUM_CHANNELS, BackendWrapper
+
+# Optional counters for the write path and the motion scheduler. Nothing here runs unless it is switched on:
+#     metrics = Metrics()
+#     pwm = InstrumentedBackend(PCAde9685.pwm, metrics)      give this to the servos as their pwm_backend
+#     scheduler = MotionScheduler(metrics=metrics)
+#     ...
+#     metrics.snapshot()                                      a dict of everything counted so far
+#     metrics.dump_prometheus("/var/lib/node_exporter/pca9685.prom")
+
+# every power of two is split into this many buckets, which keeps every bucket within 1/16 (6%) of its value
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# nanoseconds, values from 0 up to about 18 minutes can be told apart
+MAX_VALUE_BITS = 40
+NUM_BUCKETS = (MAX_VALUE_BITS - SUB_BUCKET_BITS) * SUB_BUCKETS + 2 * SUB_BUCKETS
+# bucket boundaries in seconds for the Prometheus histograms
+PROMETHEUS_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+def bucket_index(value):
+    # values below 2 * SUB_BUCKETS get a bucket each, above that every power of two gets SUB_BUCKETS buckets
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    if shift <= 0:
+        return value
+    return min(NUM_BUCKETS - 1, shift * SUB_BUCKETS + (value >> shift))
+
+
+def bucket_bounds(index):
+    # (lowest, highest) value that lands in bucket index
+    if index < 2 * SUB_BUCKETS:
+        return index, index
+    shift = index // SUB_BUCKETS - 1
+    mantissa = index - shift * SUB_BUCKETS
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    # HDR-style histogram of nanosecond values in a fixed number of log-linear buckets,
+    # recording a value is a couple of integer operations and it never grows
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * NUM_BUCKETS))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        value = max(0, int(value))
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        # the value percent of all recorded values are at or below, to within a bucket
+        if not self.count:
+            return None
+        wanted = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return min(bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def count_below(self, value):
+        # number of recorded values that are at most value, to within a bucket
+        last = bucket_index(int(value))
+        return sum(self.counts[:last + 1])
+
+    def snapshot(self):
+        # in seconds
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "min": self.min / 1e9,
+            "mean": self.total / self.count / 1e9,
+            "p50": self.percentile(50) / 1e9,
+            "p90": self.percentile(90) / 1e9,
+            "p99": self.percentile(99) / 1e9,
+            "p99.9": self.percentile(99.9) / 1e9,
+            "max": self.max / 1e9,
+        }
+
+
+class Metrics:
+    # Everything counted for one or more chips and a scheduler, chips are told apart by their I2C address
+
+    def __init__(self):
+        self.channel_writes = {}  # (chip, channel): writes that changed the channel's registers
+        self.transactions = {}  # chip: I2C transactions
+        self.bytes_sent = {}  # chip: bytes on the bus, address and register bytes included
+        self.i2c_latency = LatencyHistogram()
+        self.ticks = 0
+        self.overruns = 0
+        # how late every scheduler tick started
+        self.tick_jitter = LatencyHistogram()
+
+    def record_transfer(self, chip, num_bytes, latency_ns):
+        self.transactions[chip] = self.transactions.get(chip, 0) + 1
+        self.bytes_sent[chip] = self.bytes_sent.get(chip, 0) + num_bytes
+        self.i2c_latency.record(latency_ns)
+
+    def record_channels(self, chip, register, num_registers):
+        if ALL_LED_ON_L <= register <= ALL_LED_OFF_H:
+            channels = range(NUM_CHANNELS)
+        else:
+            first = (register - LED0_ON_L) // 4
+            last = (register + num_registers - 1 - LED0_ON_L) // 4
+            channels = range(max(0, first), min(NUM_CHANNELS - 1, last) + 1)
+        for channel in channels:
+            key = (chip, channel)
+            self.channel_writes[key] = self.channel_writes.get(key, 0) + 1
+
+    def record_tick(self, lateness_ns):
+        self.ticks += 1
+        self.tick_jitter.record(lateness_ns)
+
+    def record_overrun(self):
+        self.overruns += 1
+
+    def snapshot(self):
+        return {
+            "channel_writes": {f"{chip}/{channel}": count for (chip, channel), count in self.channel_writes.items()},
+            "transactions": dict(self.transactions),
+            "bytes_sent": dict(self.bytes_sent),
+            "i2c_latency": self.i2c_latency.snapshot(),
+            "scheduler": {"ticks": self.ticks, "overruns": self.overruns, "jitter": self.tick_jitter.snapshot()},
+        }
+
+    def prometheus_text(self):
+        # the Prometheus text exposition format
+        lines = []
+
+        def counter(name, help_text, values):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in values:
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+        def histogram(name, help_text, histogram):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for bound in PROMETHEUS_BUCKETS:
+                lines.append(f'{name}_bucket{{le="{bound}"}} {histogram.count_below(bound * 1e9)}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum {histogram.total / 1e9}")
+            lines.append(f"{name}_count {histogram.count}")
+
+        counter("pca9685_channel_writes_total", "Writes that changed a channel's registers",
+                [(f'chip="{chip}",channel="{channel}"', count)
+                 for (chip, channel), count in sorted(self.channel_writes.items())])
+        counter("pca9685_i2c_transactions_total", "I2C transactions",
+                [(f'chip="{chip}"', count) for chip, count in sorted(self.transactions.items())])
+        counter("pca9685_i2c_bytes_total", "Bytes put on the I2C bus",
+                [(f'chip="{chip}"', count) for chip, count in sorted(self.bytes_sent.items())])
+        histogram("pca9685_i2c_latency_seconds", "Time every I2C transaction took", self.i2c_latency)
+        counter("pca9685_scheduler_ticks_total", "Motion scheduler ticks", [("", self.ticks)])
+        counter("pca9685_scheduler_overruns_total", "Ticks that did not finish before the next one was due",
+                [("", self.overruns)])
+        histogram("pca9685_scheduler_jitter_seconds", "How late every motion scheduler tick started",
+                  self.tick_jitter)
+        return "\n".join(lines) + "\n"
+
+    def dump_prometheus(self, path):
+        # written to a temporary file first and then renamed, so a collector never reads half a file
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as metrics_file:
+            metrics_file.write(self.prometheus_text())
+        os.replace(temporary_path, path)
+
+
+class InstrumentedBackend(BackendWrapper):
+    # Wraps another backend and counts every transaction it makes in metrics
+
+    def __init__(self, backend, metrics=None):
+        super().__init__(backend)
+        self.metrics = metrics if metrics is not None else Metrics()
+        address = getattr(backend, "address", None)
+        self.chip = f"{address:#x}" if address is not None else str(backend.chip_key())
+
+    def read8(self, register):
+        start = time.perf_counter_ns()
+        value = self.backend.read8(register)
+        # address+W, register, address+R, data
+        self.metrics.record_transfer(self.chip, 4, time.perf_counter_ns() - start)
+        return value
+
+    def write8(self, register, value):
+        start = time.perf_counter_ns()
+        self.backend.write8(register, value)
+        self.metrics.record_transfer(self.chip, 3, time.perf_counter_ns() - start)
+        self.metrics.record_channels(self.chip, register, 1)
+
+    def write_list(self, register, data):
+        start = time.perf_counter_ns()
+        self.backend.write_list(register, data)
+        self.metrics.record_transfer(self.chip, 2 + len(data), time.perf_counter_ns() - start)
+        self.metrics.record_channels(self.chip, register, len(data))
@@ -0,0 +1,219 @@
+import threading
+import time
+from collections import deque
+
+import PCAde9685
+import trajectories
+from PCAde9685 import servo_frequency, set_servo_pwms
+from motion_thread import MotionThread
+
+
+class MotionHandle:
+    # Returned for every motion submitted to a MotionScheduler instead of sleeping until it is done
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.cancelled = False
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        # blocks until the motion (including its hold time) has finished, returns False on timeout
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        # the servo stays wherever it was last written to
+        self.cancelled = True
+        self._done.set()
+
+
+class MotionHandleGroup:
+    # One handle for motions submitted together, eg. a whole ServoGroup2
+
+    def __init__(self, handles):
+        self.handles = handles
+
+    def done(self):
+        return all(handle.done() for handle in self.handles)
+
+    def wait(self, timeout=None):
+        end_time = None if timeout is None else time.monotonic() + timeout
+        for handle in self.handles:
+            remaining = None if end_time is None else max(0.0, end_time - time.monotonic())
+            if not handle.wait(remaining):
+                return False
+        return True
+
+    def cancel(self):
+        for handle in self.handles:
+            handle.cancel()
+
+
+class Motion:
+    def __init__(self, servo, start_angle, end_angle, duration, hold, clock_start, handle, easing=None,
+                 max_acceleration=None):
+        self.servo = servo
+        self.start_angle = start_angle
+        self.end_angle = end_angle
+        if easing is None:
+            easing = PCAde9685.glide_easing
+        self.easing, self.duration, self.accel_fraction = trajectories.plan(
+            end_angle - start_angle, duration, easing, max_acceleration)
+        self.hold = hold
+        self.clock_start = clock_start
+        self.handle = handle
+        self.start_time = None
+        self.last_angle = None
+
+    def angle_at(self, now):
+        if self.duration <= 0:
+            return self.end_angle
+        progress = min(1.0, (now - self.start_time) / self.duration)
+        progress = trajectories.progress_at(self.easing, progress, self.accel_fraction)
+        return self.start_angle + (self.end_angle - self.start_angle) * progress
+
+
+class Oscillation:
+    # A servo following an oscillators.Oscillator for duration seconds, runs on the scheduler like a Motion
+
+    def __init__(self, servo, oscillator, duration, clock_start, handle):
+        self.servo = servo
+        self.oscillator = oscillator
+        self.duration = duration
+        self.hold = 0
+        self.clock_start = clock_start
+        self.handle = handle
+        self.start_time = None
+        self.last_angle = None
+
+    def angle_at(self, now):
+        return self.oscillator.angle_at(now - self.start_time)
+
+
+def per_servo(angle, num_servos):
+    # one angle for each of num_servos servos, from a single angle or a sequence of them
+    try:
+        angles = list(angle)
+    except TypeError:
+        return [angle] * num_servos
+    if len(angles) != num_servos:
+        raise ValueError(f"Got {len(angles)} angles for {num_servos} servos")
+    return angles
+
+
+class MotionScheduler:
+    # Drives every servo from one fixed-rate tick.
+    # Each servo has a queue of motions; on every tick the active motion of every servo is evaluated and
+    # all of the resulting ticks go out as one batched frame, so motions on different servos run concurrently.
+
+    def __init__(self, rate=servo_frequency, metrics=None, spin_time=0.0005, priority=None, cpus=None):
+        # metrics (an instrumentation.Metrics) counts the ticks, how late they started and the overruns
+        # spin_time, priority and cpus tune the thread the ticks run on, see MotionThread
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.queues = {}  # servo: deque of motions, the first one is the active one
+        self.lock = threading.Lock()
+        self.thread = MotionThread(lambda now_ns: self.tick(now_ns / 1e9), self.period, "motion-scheduler",
+                                   spin_time, priority, cpus, metrics)
+
+    @property
+    def running(self):
+        return self.thread.running
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.thread.stop()
+
+    def stats(self):
+        # ticks, missed deadlines and how late the ticks started
+        return self.thread.stats()
+
+    def submit(self, servo, start_angle, end_angle, duration=0, hold=0, clock_start=0, easing=None,
+               max_acceleration=None):
+        # queue a move of servo from start_angle to end_angle over duration seconds, then hold it for hold seconds
+        with self.lock:
+            handle = self._queue(servo, start_angle, end_angle, duration, hold, clock_start, easing, max_acceleration)
+        if not self.running:
+            self.start()
+        return handle
+
+    def _queue(self, servo, start_angle, end_angle, duration, hold, clock_start, easing, max_acceleration):
+        handle = MotionHandle()
+        motion = Motion(servo, start_angle, end_angle, duration, hold, clock_start, handle, easing, max_acceleration)
+        self.queues.setdefault(servo, deque()).append(motion)
+        return handle
+
+    def submit_group(self, servos, start_angle, end_angle, duration=0, hold=0, clock_start=0, easing=None,
+                     max_acceleration=None):
+        # the same motion for every servo, they all start on the same tick
+        # start_angle and end_angle can also be sequences with one angle per servo
+        servos = list(servos)
+        start_angles = per_servo(start_angle, len(servos))
+        end_angles = per_servo(end_angle, len(servos))
+        with self.lock:
+            handles = [self._queue(servo, servo_start, servo_end, duration, hold, clock_start, easing, max_acceleration)
+                       for servo, servo_start, servo_end in zip(servos, start_angles, end_angles)]
+        if not self.running:
+            self.start()
+        return MotionHandleGroup(handles)
+
+    def submit_oscillation(self, servos, servo_oscillators, duration, clock_start=0):
+        # every servo follows its oscillator for duration seconds, they all start on the same tick
+        handles = []
+        with self.lock:
+            for servo, oscillator in zip(servos, servo_oscillators):
+                handle = MotionHandle()
+                self.queues.setdefault(servo, deque()).append(
+                    Oscillation(servo, oscillator, duration, clock_start, handle))
+                handles.append(handle)
+        if not self.running:
+            self.start()
+        return MotionHandleGroup(handles)
+
+    def cancel(self, servo):
+        # drop everything queued for servo
+        with self.lock:
+            motions = self.queues.pop(servo, ())
+        for motion in motions:
+            motion.handle.cancel()
+
+    def idle(self):
+        with self.lock:
+            return not self.queues
+
+    def tick(self, now=None):
+        # evaluate all active motions at time now and write them out as one frame
+        if now is None:
+            now = time.monotonic()
+        servo_ticks = []
+        finished = []
+        with self.lock:
+            for servo, queue in list(self.queues.items()):
+                while queue and queue[0].handle.cancelled:
+                    queue.popleft()
+                if not queue:
+                    del self.queues[servo]
+                    continue
+                motion = queue[0]
+                if motion.start_time is None:
+                    motion.start_time = now
+                angle = motion.angle_at(now)
+                if angle != motion.last_angle:
+                    motion.last_angle = angle
+                    servo.currentAngle, pulse_width = servo.pulse_width(angle)
+                    servo_ticks.append((servo, (motion.clock_start, pulse_width + motion.clock_start)))
+                if now - motion.start_time >= motion.duration + motion.hold:
+                    finished.append(queue.popleft())
+                    if not queue:
+                        del self.queues[servo]
+        try:
+            if servo_ticks:
+                set_servo_pwms(servo_ticks)
+        finally:
+            # the finished motions are off their queues, so their handles are done even when the write failed
+            for motion in finished:
+                motion.handle._done.set()
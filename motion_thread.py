@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+
+from PCAde9685 import logger
+
+
+def sleep_until(deadline_ns, spin_time_ns=0):
+    # Sleeps until the monotonic clock reaches deadline_ns. time.sleep tends to wake up late, so the
+    # last spin_time_ns are spent spinning on the clock instead, which costs CPU but lands on time.
+    remaining = deadline_ns - time.monotonic_ns()
+    if remaining > spin_time_ns:
+        time.sleep((remaining - spin_time_ns) / 1e9)
+    while time.monotonic_ns() < deadline_ns:
+        pass
+
+
+class MotionThread:
+    # Calls callback(now_ns) every period seconds on a thread of its own.
+    # The deadlines are absolute (start + n * period on time.monotonic_ns), so neither the time the callback
+    # takes nor a late wake-up ever shifts the ones after it, and everything driven by one of these stays in
+    # lockstep for hours. A tick that starts after the next one was due counts as a missed deadline; the
+    # deadlines that were missed are skipped rather than run in a burst.
+
+    def __init__(self, callback, period, name="motion", spin_time=0.0005, priority=None, cpus=None, metrics=None):
+        # spin_time    seconds before every deadline that are spun instead of slept, 0 to always sleep
+        # priority     SCHED_FIFO priority (1-99) for the thread, needs root or CAP_SYS_NICE
+        # cpus         CPUs the thread is pinned to, eg. {3} with isolcpus=3 on the kernel command line
+        # metrics      an instrumentation.Metrics that records how late every tick started and the missed ones
+        self.callback = callback
+        self.period_ns = int(period * 1e9)
+        self.name = name
+        self.spin_time_ns = int(spin_time * 1e9)
+        self.priority = priority
+        self.cpus = cpus
+        self.metrics = metrics
+        self.running = False
+        self.thread = None
+        self.ticks = 0
+        self.missed_deadlines = 0
+        self.failed_ticks = 0
+        self.max_lateness_ns = 0
+        self.total_lateness_ns = 0
+
+    def start(self):
+        if self.running:
+            return self
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def stats(self):
+        return {
+            "ticks": self.ticks,
+            "missed_deadlines": self.missed_deadlines,
+            "failed_ticks": self.failed_ticks,
+            "max_lateness": self.max_lateness_ns / 1e9,
+            "mean_lateness": self.total_lateness_ns / self.ticks / 1e9 if self.ticks else 0.0,
+        }
+
+    def _make_realtime(self):
+        # both only apply to the calling thread, and only on Linux; without permission the thread carries on as is
+        if self.cpus is not None:
+            try:
+                os.sched_setaffinity(0, self.cpus)
+            except (AttributeError, OSError) as error:
+                logger.warning("Could not pin %s thread to CPUs %s: %s", self.name, self.cpus, error)
+        if self.priority is not None:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+            except (AttributeError, OSError) as error:
+                logger.warning("Could not give %s thread SCHED_FIFO priority %s: %s", self.name, self.priority, error)
+
+    def _run(self):
+        self._make_realtime()
+        deadline = time.monotonic_ns()
+        failing = False
+        while self.running:
+            sleep_until(deadline, self.spin_time_ns)
+            now = time.monotonic_ns()
+            lateness = now - deadline
+            self.ticks += 1
+            self.total_lateness_ns += lateness
+            if lateness > self.max_lateness_ns:
+                self.max_lateness_ns = lateness
+            if self.metrics is not None:
+                self.metrics.record_tick(lateness)
+
+            try:
+                self.callback(now)
+                failing = False
+            except Exception:
+                # a failed tick (eg. an I2C error) must not end the thread, the next one runs as usual;
+                # only the first of a run of failures is logged so a dead bus does not flood the log
+                self.failed_ticks += 1
+                if not failing:
+                    logger.exception("%s callback failed", self.name)
+                failing = True
+
+            deadline += self.period_ns
+            behind = time.monotonic_ns() - deadline
+            if behind > 0:
+                # skip the deadlines that have already passed, staying on the same grid
+                missed = behind // self.period_ns + 1
+                self.missed_deadlines += missed
+                if self.metrics is not None:
+                    for _ in range(missed):
+                        self.metrics.record_overrun()
+                deadline += missed * self.period_ns
@@ -0,0 +1,57 @@
+import math
+
+
+# Waveforms map the phase of an oscillation (0 to 1 over one period) to a position between -1 and 1,
+# all of them start in the middle or at the top and go up first
+
+def sine(phase):
+    return math.sin(2 * math.pi * phase)
+
+
+def square(phase):
+    return 1.0 if phase < 0.5 else -1.0
+
+
+def triangle(phase):
+    if phase < 0.25:
+        return 4 * phase
+    if phase < 0.75:
+        return 2 - 4 * phase
+    return 4 * phase - 4
+
+
+waveforms = {
+    "sine": sine,
+    "square": square,
+    "triangle": triangle,
+}
+
+
+class Oscillator:
+    # The angle of a servo swinging around center: center + amplitude * waveform(frequency * t + phase).
+    # frequency is in periods per second and phase in periods, eg. a phase of 0.5 starts half a period later.
+    # A negative amplitude swings the other way first.
+
+    def __init__(self, waveform="sine", frequency=1.0, amplitude=90.0, center=90.0, phase=0.0):
+        if waveform not in waveforms:
+            raise ValueError(f"Unknown waveform {waveform}, choose from {', '.join(waveforms)}")
+        self.waveform = waveform
+        self.wave = waveforms[waveform]
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.center = center
+        self.phase = phase
+
+    def angle_at(self, t):
+        # t is the number of seconds since the oscillation started
+        return self.center + self.amplitude * self.wave((self.frequency * t + self.phase) % 1.0)
+
+
+def oscillation_frames(oscillators, duration, update_rate):
+    # (angles, seconds to hold them) for every frame of duration seconds at update_rate frames per second,
+    # with one angle per oscillator
+    num_frames = max(1, int(round(duration * update_rate)))
+    frame_time = duration / num_frames
+    for frame in range(num_frames):
+        t = frame * frame_time
+        yield [oscillator.angle_at(t) for oscillator in oscillators], frame_time
@@ -0,0 +1,518 @@
+import math
+import time
+
+# PCA9685 registers
+MODE1 = 0x00
+MODE2 = 0x01
+SUBADR1 = 0x02
+SUBADR2 = 0x03
+SUBADR3 = 0x04
+ALLCALLADR = 0x05
+LED0_ON_L = 0x06
+ALL_LED_ON_L = 0xFA
+ALL_LED_ON_H = 0xFB
+ALL_LED_OFF_L = 0xFC
+ALL_LED_OFF_H = 0xFD
+PRESCALE = 0xFE
+
+# MODE1 bits
+RESTART = 0x80
+AUTO_INCREMENT = 0x20
+SLEEP = 0x10
+SUB1 = 0x08
+SUB2 = 0x04
+SUB3 = 0x02
+ALLCALL = 0x01
+# MODE2 bits
+OUTDRV = 0x04
+
+# the internal oscillator and the 12-bit counter define the PWM period
+OSCILLATOR_FREQUENCY = 25000000
+TICKS_PER_PERIOD = 4096
+NUM_CHANNELS = 16
+# every PCA9685 on a bus answers to this I2C address when ALLCALL is enabled (the power-on default)
+ALLCALL_ADDRESS = 0x70
+# an SMBus block write carries at most 32 data bytes, which is 8 channels (4 registers each)
+MAX_BLOCK_CHANNELS = 8
+
+
+def channel_runs(channels):
+    # Split a collection of channels into the fewest runs of contiguous channels,
+    # each run short enough to fit into a single block write
+    runs = []
+    for channel in sorted(set(channels)):
+        if runs and channel == runs[-1][-1] + 1 and len(runs[-1]) < MAX_BLOCK_CHANNELS:
+            runs[-1].append(channel)
+        else:
+            runs.append([channel])
+    return runs
+
+
+def prescale_for_frequency(freq_hz):
+    # same rounding the Adafruit driver uses
+    prescale_value = OSCILLATOR_FREQUENCY / float(TICKS_PER_PERIOD) / float(freq_hz) - 1.0
+    return int(math.floor(prescale_value + 0.5))
+
+
+def frequency_for_prescale(prescale):
+    return OSCILLATOR_FREQUENCY / (TICKS_PER_PERIOD * (prescale + 1.0))
+
+
+def bit_reverse(value, bits):
+    result = 0
+    for _ in range(bits):
+        result = (result << 1) | (value & 1)
+        value >>= 1
+    return result
+
+
+def tick_bytes(on, off):
+    # LEDn_ON_L, LEDn_ON_H, LEDn_OFF_L, LEDn_OFF_H
+    return [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+
+
+def default_busnum():
+    # The bus the Adafruit driver picks when none is given, looking it up does not open the bus.
+    # Imported here so the rest of the module can be used on machines without the driver installed,
+    # there (or on a board the driver does not know) this is None.
+    try:
+        import Adafruit_GPIO.I2C as I2C
+        return I2C.get_default_bus()
+    except (ImportError, RuntimeError):
+        return None
+
+
+# chips that have already been brought up by this process, {chip key: frequency}
+_configured_chips = {}
+
+
+class PWMBackend:
+    # Anything that can drive a PCA9685 chip.
+    # A backend only has to provide the register primitives read8, write8 and write_list, every PWM
+    # operation below is built on top of them so each backend puts exactly the same bytes on the bus.
+    # Nothing touches the chip until the first write, see ensure_ready.
+
+    # seconds the oscillator needs to settle after waking up
+    oscillator_settle_time = 0.005
+
+    def __init__(self, stagger=False, unused_channels=()):
+        self.frequency_hz = None
+        self.ready = False
+        # channels with nothing connected, a broadcast to all 16 channels is allowed to overwrite them
+        self.unused_channels = frozenset(unused_channels)
+        # with stagger every channel starts its pulse at its own ON tick (see phase_offset), so the servos
+        # do not all draw current at the same moment of the period
+        self.stagger = stagger
+        self.phase_offsets = {}
+        # shadow of the last ON/OFF ticks written to each channel, {channel: (on, off)}
+        # writes that would not change the registers are dropped
+        self.shadow = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def read8(self, register):
+        raise NotImplementedError
+
+    def write8(self, register, value):
+        raise NotImplementedError
+
+    def write_list(self, register, data):
+        raise NotImplementedError
+
+    def chip_key(self):
+        # identifies the physical chip so it is only configured once per process
+        raise NotImplementedError
+
+    def ensure_ready(self):
+        # Bring the chip up on first use. A chip that is already awake at the requested frequency
+        # (another process configured it) is left alone, so the outputs do not glitch.
+        key = self.chip_key()
+        if key in _configured_chips and _configured_chips[key] == self.frequency_hz:
+            self.ready = True
+            return
+
+        mode1 = self.read8(MODE1)
+        if mode1 & SLEEP:
+            # fresh from power-on (or put to sleep), do the full start-up
+            self.initialize()
+        elif not mode1 & AUTO_INCREMENT:
+            self.write8(MODE1, (mode1 & ~RESTART) | AUTO_INCREMENT)
+        if self.frequency_hz is not None and self.read8(PRESCALE) != prescale_for_frequency(self.frequency_hz):
+            self.configure_frequency(self.frequency_hz)
+
+        _configured_chips[key] = self.frequency_hz
+        self.ready = True
+
+    def initialize(self):
+        # same start-up sequence as the Adafruit driver: all outputs off, totem pole outputs,
+        # respond to ALLCALL, then wake the oscillator up
+        self.write8(MODE1, SLEEP | ALLCALL | AUTO_INCREMENT)
+        self.write_list(ALL_LED_ON_L, tick_bytes(0, 0))
+        self.write8(MODE2, OUTDRV)
+        self.write8(MODE1, ALLCALL | AUTO_INCREMENT)
+        time.sleep(self.oscillator_settle_time)
+        self.shadow = dict.fromkeys(range(NUM_CHANNELS), (0, 0))
+
+    def invalidate_cache(self):
+        # call this after the chip was reset behind our back, the next write to every channel goes to the bus
+        self.shadow = {}
+
+    def set_pwm_freq(self, freq_hz):
+        # only remembered here, the prescaler is written by ensure_ready on the first write
+        if freq_hz == self.frequency_hz:
+            return
+        self.frequency_hz = freq_hz
+        if self.ready:
+            self.configure_frequency(freq_hz)
+            _configured_chips[self.chip_key()] = freq_hz
+
+    def configure_frequency(self, freq_hz):
+        prescale = prescale_for_frequency(freq_hz)
+        old_mode = self.read8(MODE1) & ~RESTART
+        # the prescaler can only be written while the oscillator is asleep
+        self.write8(MODE1, old_mode | SLEEP)
+        self.write8(PRESCALE, prescale)
+        self.write8(MODE1, old_mode)
+        time.sleep(self.oscillator_settle_time)
+        self.write8(MODE1, old_mode | RESTART)
+
+    @property
+    def actual_frequency(self):
+        # the frequency the chip really runs at, the prescaler can only get close to the requested one
+        return frequency_for_prescale(prescale_for_frequency(self.frequency_hz))
+
+    def microseconds_to_ticks(self, microseconds):
+        return microseconds * self.actual_frequency * TICKS_PER_PERIOD / 1000000.0
+
+    def phase_offset(self, channel):
+        # The ON tick given to channel the first time it is written, it never changes afterwards.
+        # Slots are handed out in bit-reversed order (0, 2048, 1024, 3072, 512, ...) so however many
+        # channels are in use they are spread evenly over the period.
+        offset = self.phase_offsets.get(channel)
+        if offset is None:
+            slot = bit_reverse(len(self.phase_offsets) % NUM_CHANNELS, 4)
+            offset = slot * (TICKS_PER_PERIOD // NUM_CHANNELS)
+            self.phase_offsets[channel] = offset
+        return offset
+
+    def staggered(self, channel, on, off):
+        # shifts a pulse by the channel's phase offset, wrapping around the end of the period
+        if on & 0x1000 or off & 0x1000:
+            # full on / full off have no pulse to shift
+            return on, off
+        offset = self.phase_offset(channel)
+        return (on + offset) % TICKS_PER_PERIOD, (off + offset) % TICKS_PER_PERIOD
+
+    def _write_channel(self, channel, on, off):
+        if self.shadow.get(channel, (None,))[0] == on:
+            # the ON ticks are already in place (always the case with pinned phase offsets), only write OFF
+            self.write_list(LED0_ON_L + 4 * channel + 2, [off & 0xFF, off >> 8])
+        else:
+            self.write_list(LED0_ON_L + 4 * channel, tick_bytes(on, off))
+
+    def set_pwm(self, channel, on, off):
+        # on and off are 12-bit values so they are in between 0 and 4095
+        if self.stagger:
+            on, off = self.staggered(channel, on, off)
+        if self.shadow.get(channel) == (on, off):
+            self.cache_hits += 1
+            return
+        if not self.ready:
+            self.ensure_ready()
+        self.cache_misses += 1
+        self._write_channel(channel, on, off)
+        self.shadow[channel] = (on, off)
+
+    def set_multiple_pwm(self, channel_ticks):
+        # channel_ticks is a dict of {channel: (on, off)}
+        # contiguous channels are written with one auto-increment block write starting at LEDn_ON_L,
+        # so a whole group is updated in one (or a few) I2C transactions and latches in the same PWM period
+        changed = self.pending_changes(channel_ticks)
+        if changed:
+            self.write_changes(changed)
+
+    def pending_changes(self, channel_ticks):
+        # the ticks (after staggering) of the channels that actually need writing
+        changed = {}
+        for channel, ticks in channel_ticks.items():
+            if self.stagger:
+                ticks = self.staggered(channel, *ticks)
+            if self.shadow.get(channel) == ticks:
+                self.cache_hits += 1
+            else:
+                changed[channel] = ticks
+        return changed
+
+    def broadcast_ticks(self, changed):
+        # When writing changed leaves every connected channel with the same ticks, returns them:
+        # one write to the ALL_LED registers then does the job. Never happens with stagger.
+        if len(changed) < 2:
+            return None
+        ticks = next(iter(changed.values()))
+        for channel in range(NUM_CHANNELS):
+            if channel not in self.unused_channels and changed.get(channel, self.shadow.get(channel)) != ticks:
+                return None
+        return ticks
+
+    def write_changes(self, changed):
+        if not self.ready:
+            self.ensure_ready()
+        self.cache_misses += len(changed)
+        ticks = self.broadcast_ticks(changed)
+        if ticks is not None:
+            self.write_list(ALL_LED_ON_L, tick_bytes(*ticks))
+            self.shadow = dict.fromkeys(range(NUM_CHANNELS), ticks)
+            return
+        for run in channel_runs(changed):
+            if len(run) == 1:
+                self._write_channel(run[0], *changed[run[0]])
+                continue
+            data = []
+            for channel in run:
+                on, off = changed[channel]
+                data += tick_bytes(on, off)
+            self.write_list(LED0_ON_L + 4 * run[0], data)
+        self.shadow.update(changed)
+
+    def set_all_pwm(self, on, off):
+        if not self.ready:
+            self.ensure_ready()
+        self.write_list(ALL_LED_ON_L, tick_bytes(on, off))
+        self.shadow = dict.fromkeys(range(NUM_CHANNELS), (on, off))
+
+
+class AdafruitBackend(PWMBackend):
+    # Real hardware through the Adafruit I2C device layer.
+    # The bus is only opened on the first write, so creating one of these (or importing PCAde9685) costs nothing.
+
+    def __init__(self, address=0x40, busnum=None, stagger=False, unused_channels=()):
+        super().__init__(stagger, unused_channels)
+        self.address = address
+        # resolved right away so chip_key (and the bus a pool files the board under) never changes
+        self.busnum = busnum if busnum is not None else default_busnum()
+        self._device = None
+
+    @property
+    def device(self):
+        if self._device is None:
+            import Adafruit_GPIO.I2C as I2C
+            self._device = I2C.get_i2c_device(self.address, busnum=self.busnum)
+        return self._device
+
+    def chip_key(self):
+        return self.busnum, self.address
+
+    def read8(self, register):
+        return self.device.readU8(register)
+
+    def write8(self, register, value):
+        self.device.write8(register, value)
+
+    def write_list(self, register, data):
+        self.device.writeList(register, data)
+
+
+def _wrapped_attribute(name):
+    # an attribute of a BackendWrapper that is read from and written to the wrapped backend
+    return property(lambda self: getattr(self.backend, name),
+                    lambda self, value: setattr(self.backend, name, value))
+
+
+class BackendWrapper(PWMBackend):
+    # Sits in front of another backend, eg. to record or measure its writes (see traces.py and
+    # instrumentation.py). The PWM logic runs in the wrapper and the register primitives are passed on.
+    # What the backend knows about the chip (frequency, shadow, phase offsets) stays with the wrapped
+    # backend, so servos on the backend itself and servos on wrappers of it can share the chip.
+    frequency_hz = _wrapped_attribute("frequency_hz")
+    ready = _wrapped_attribute("ready")
+    stagger = _wrapped_attribute("stagger")
+    unused_channels = _wrapped_attribute("unused_channels")
+    phase_offsets = _wrapped_attribute("phase_offsets")
+    shadow = _wrapped_attribute("shadow")
+
+    def __init__(self, backend):
+        # PWMBackend.__init__ is not called, it would reset the state of the wrapped backend
+        self.backend = backend
+        # counted for the writes made through this wrapper only
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def chip_key(self):
+        return self.backend.chip_key()
+
+    def read8(self, register):
+        return self.backend.read8(register)
+
+    def write8(self, register, value):
+        self.backend.write8(register, value)
+
+    def write_list(self, register, data):
+        self.backend.write_list(register, data)
+
+
+class SimulatedI2CBus:
+    # Counts what would go over an I2C bus and how long it would take.
+    # Every byte on the wire is 8 data bits plus the ACK bit, and a transaction adds a start and a stop condition.
+    # With realtime every transaction also takes as long as it would on a real bus.
+
+    def __init__(self, clock_hz=100000, realtime=False):
+        self.clock_hz = clock_hz
+        self.realtime = realtime
+        self.devices = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.transactions = 0
+        self.bytes_sent = 0
+        self.bus_time = 0.0
+
+    def attach(self, device):
+        self.devices[device.address] = device
+
+    def answering(self, address):
+        # the chips that answer to address: their own address, or ALLCALL/a subaddress they have enabled
+        chips = []
+        for device in self.devices.values():
+            registers = device.registers
+            if device.address == address:
+                chips.append(device)
+            elif registers[MODE1] & ALLCALL and registers[ALLCALLADR] >> 1 == address:
+                chips.append(device)
+            elif any(registers[MODE1] & bit and registers[subaddress] >> 1 == address
+                     for bit, subaddress in ((SUB1, SUBADR1), (SUB2, SUBADR2), (SUB3, SUBADR3))):
+                chips.append(device)
+        return chips
+
+    def transaction_time(self, num_bytes, repeated_starts=0):
+        bits = 9 * num_bytes + 2 + repeated_starts
+        return bits / float(self.clock_hz)
+
+    def account(self, num_bytes, repeated_starts=0):
+        self.transactions += 1
+        self.bytes_sent += num_bytes
+        elapsed = self.transaction_time(num_bytes, repeated_starts)
+        self.bus_time += elapsed
+        if self.realtime:
+            time.sleep(elapsed)
+        return elapsed
+
+
+class SimulatedPCA9685(PWMBackend):
+    # In-memory PCA9685: a 256 byte register file that behaves like the chip (prescaler only writable
+    # while asleep, auto-increment, ALL_LED broadcast registers) and charges every transaction to a simulated bus
+    oscillator_settle_time = 0
+
+    def __init__(self, address=0x40, bus=None, clock_hz=100000, stagger=False, unused_channels=()):
+        super().__init__(stagger, unused_channels)
+        self.address = address
+        self.bus = bus if bus is not None else SimulatedI2CBus(clock_hz)
+        self.bus.attach(self)
+        self.registers = bytearray(256)
+        self.power_on_reset()
+
+    def power_on_reset(self):
+        self.registers[:] = bytes(256)
+        self.registers[MODE1] = SLEEP | ALLCALL
+        self.registers[MODE2] = OUTDRV
+        self.registers[SUBADR1] = 0xE2
+        self.registers[SUBADR2] = 0xE4
+        self.registers[SUBADR3] = 0xE8
+        self.registers[ALLCALLADR] = 0xE0
+        self.registers[PRESCALE] = 0x1E
+        for channel in range(NUM_CHANNELS):
+            # every output starts fully off
+            self.registers[LED0_ON_L + 4 * channel + 3] = 0x10
+        self.ready = False
+        self.invalidate_cache()
+        _configured_chips.pop(self.chip_key(), None)
+
+    def chip_key(self):
+        return self.bus, self.address
+
+    # register primitives, each one is a single bus transaction
+
+    def read8(self, register):
+        # address+W, register, repeated start, address+R, data
+        self.bus.account(4, repeated_starts=1)
+        if ALL_LED_ON_L <= register <= ALL_LED_OFF_H:
+            return 0
+        return self.registers[register]
+
+    def write8(self, register, value):
+        # address+W, register, data
+        self.bus.account(3)
+        self._store(register, value)
+
+    def write_list(self, register, data):
+        self.bus.account(2 + len(data))
+        self.receive(register, data)
+
+    def receive(self, register, data):
+        # the data bytes of a write transaction addressed to this chip
+        auto_increment = self.registers[MODE1] & AUTO_INCREMENT
+        for value in data:
+            self._store(register, value)
+            if auto_increment:
+                register = (register + 1) & 0xFF
+
+    def _store(self, register, value):
+        value &= 0xFF
+        if register == MODE1:
+            # RESTART is cleared by the chip once the oscillator is running again
+            self.registers[MODE1] = value & ~RESTART
+        elif register == PRESCALE:
+            if self.registers[MODE1] & SLEEP:
+                self.registers[PRESCALE] = max(value, 3)
+        elif ALL_LED_ON_L <= register <= ALL_LED_OFF_H:
+            offset = register - ALL_LED_ON_L
+            for channel in range(NUM_CHANNELS):
+                self.registers[LED0_ON_L + 4 * channel + offset] = value
+        elif register < 0xFB or register > PRESCALE:
+            self.registers[register] = value
+
+    # helpers for looking at the simulated outputs
+
+    @property
+    def frequency(self):
+        return frequency_for_prescale(self.registers[PRESCALE])
+
+    def channel_ticks(self, channel):
+        base = LED0_ON_L + 4 * channel
+        on = self.registers[base] | ((self.registers[base + 1] & 0x1F) << 8)
+        off = self.registers[base + 2] | ((self.registers[base + 3] & 0x1F) << 8)
+        return on, off
+
+    def pulse_width_us(self, channel):
+        on, off = self.channel_ticks(channel)
+        if off & 0x1000 or self.registers[MODE1] & SLEEP:
+            return 0.0
+        if on & 0x1000:
+            return 1000000.0 / self.frequency
+        ticks = (off - on) % TICKS_PER_PERIOD
+        return ticks * 1000000.0 / (self.frequency * TICKS_PER_PERIOD)
+
+
+class SimulatedGroupAddress(PWMBackend):
+    # Writes on a simulated bus to the ALLCALL address or a subaddress: one transaction that every chip
+    # answering to the address stores. Reads are not possible (several chips would answer).
+
+    def __init__(self, address=ALLCALL_ADDRESS, bus=None):
+        super().__init__()
+        self.address = address
+        self.bus = bus
+        # the chips are brought up through their own addresses
+        self.ready = True
+
+    def chip_key(self):
+        return self.bus, self.address
+
+    def read8(self, register):
+        raise IOError(f"Cannot read through group address {self.address:#x}")
+
+    def write8(self, register, value):
+        self.write_list(register, [value])
+
+    def write_list(self, register, data):
+        self.bus.account(2 + len(data))
+        for chip in self.bus.answering(self.address):
+            chip.receive(register, data)
@@ -0,0 +1,193 @@
+import json
+from array import array
+
+import trajectories
+from PCAde9685 import glide_rate, run_steps, run_steps_async, set_servo_pwms
+
+# Routines described as data instead of code, see pumpkin_routines.json for the ServoPumpkin routines.
+#
+# A routine file looks like:
+# {
+#   "rate": 60,                               frames per second, defaults to glide_rate
+#   "routines": {
+#     "rows": {
+#       "params": {"delay_amount": 1},        defaults for anything a step refers to by name
+#       "steps": [
+#         {"include": "reset_out"},           runs another routine of the file, "params" can override its defaults
+#                                             and "repeat" runs it several times
+#         {"angles": {"eye0": 0, "eye3": 180}, "hold": "delay_amount"},
+#         {"angles": {"eye0": 180}, "glide": 0.5, "easing": "ease_in_out"}
+#       ]
+#     }
+#   }
+# }
+#
+# Every step moves the eyes it names to their angles, gliding over "glide" seconds when given
+# (otherwise it snaps there), and then holds everything for "hold" seconds. Eyes that are not named keep
+# their position. Any number can be replaced by the name of a param.
+#
+# compile_routine turns a routine into a FrameTable: the pulse width of every eye for every frame,
+# worked out once, so playing it back is only comparing and writing ticks.
+
+
+def load_routines(path):
+    # .yaml and .yml files need PyYAML, everything else is read as JSON
+    with open(path) as routine_file:
+        if path.endswith((".yaml", ".yml")):
+            # imported here so PyYAML is only needed for YAML files
+            import yaml
+            return yaml.safe_load(routine_file)
+        return json.load(routine_file)
+
+
+def eye_roles(eyes):
+    # the names routine files use for a pumpkin's eyes, eye0 being the first one
+    return {f"eye{index}": eye for index, eye in enumerate(eyes)}
+
+
+def compile_routine(routine_file, name, servos, rate=None, **params):
+    # routine_file is what load_routines returns, servos maps the names used in the file to Servo objects
+    # params override the routine's own defaults, eg. delay_amount=0.5
+    if rate is None:
+        rate = routine_file.get("rate", glide_rate)
+    roles = list(servos)
+    compiler = _RoutineCompiler(routine_file["routines"], roles, rate)
+    compiler.run(name, params)
+    compiler.finish()
+
+    frames = array('H')
+    conversions = [{} for _ in roles]
+    for frame in compiler.frames:
+        for column, angle in enumerate(frame):
+            if angle is None:
+                # not driven yet, the player leaves the channel alone
+                frames.append(0)
+                continue
+            if angle not in conversions[column]:
+                conversions[column][angle] = servos[roles[column]].pulse_width(angle)[1]
+            frames.append(conversions[column][angle])
+    return FrameTable([servos[role] for role in roles], rate, frames, compiler.angles)
+
+
+class _RoutineCompiler:
+    # walks the steps of a routine and collects the angle of every eye for every frame
+
+    def __init__(self, routines, roles, rate):
+        self.routines = routines
+        self.columns = {role: column for column, role in enumerate(roles)}
+        self.rate = rate
+        self.angles = [None] * len(roles)
+        self.frames = []
+        # the frame boundaries come from the total time so far, so rounding never adds up over a long routine
+        self.time = 0.0
+
+    def run(self, name, overrides):
+        if name not in self.routines:
+            raise ValueError(f"Unknown routine {name}, choose from {', '.join(self.routines)}")
+        routine = self.routines[name]
+        params = dict(routine.get("params", {}))
+        params.update(overrides)
+
+        def value(number):
+            if isinstance(number, str):
+                if number not in params:
+                    raise ValueError(f"Routine {name} uses {number} but it has no value")
+                return params[number]
+            return number
+
+        for step in routine["steps"]:
+            if "include" in step:
+                include_params = {key: value(number) for key, number in step.get("params", {}).items()}
+                for _ in range(int(value(step.get("repeat", 1)))):
+                    self.run(step["include"], include_params)
+                continue
+            targets = {}
+            for role, angle in step.get("angles", {}).items():
+                if role not in self.columns:
+                    raise ValueError(f"Routine {name} moves {role}, which is not one of {', '.join(self.columns)}")
+                targets[self.columns[role]] = value(angle)
+            glide_time = value(step.get("glide", 0))
+            if glide_time > 0:
+                # the easing is either a curve name or the name of a param holding one
+                easing = step.get("easing", "linear")
+                self.glide(targets, glide_time, params.get(easing, easing))
+            else:
+                for column, angle in targets.items():
+                    self.angles[column] = angle
+            self.hold(value(step.get("hold", 0)))
+
+    def advance(self, seconds):
+        # number of frames that fit into the next seconds
+        start_frame = int(round(self.time * self.rate))
+        self.time += seconds
+        return int(round(self.time * self.rate)) - start_frame
+
+    def glide(self, targets, glide_time, easing):
+        easing, glide_time, accel_fraction = trajectories.plan(0, glide_time, easing)
+        starts = {column: self.angles[column] if self.angles[column] is not None else angle
+                  for column, angle in targets.items()}
+        num_frames = self.advance(glide_time)
+        for frame in range(num_frames):
+            progress = trajectories.progress_at(easing, frame / num_frames, accel_fraction)
+            for column, angle in targets.items():
+                self.angles[column] = starts[column] + (angle - starts[column]) * progress
+            self.frames.append(tuple(self.angles))
+        for column, angle in targets.items():
+            self.angles[column] = angle
+
+    def hold(self, seconds):
+        self.frames.extend([tuple(self.angles)] * self.advance(seconds))
+
+    def finish(self):
+        # a last frame so whatever the routine ends on is written too
+        if not self.frames or self.frames[-1] != tuple(self.angles):
+            self.frames.append(tuple(self.angles))
+
+
+class FrameTable:
+    # A compiled routine: frames is a flat array of pulse widths in ticks, one row of len(servos) per frame,
+    # frame n is written n / rate seconds after the start. A pulse width of 0 leaves the channel alone.
+
+    def __init__(self, servos, rate, frames, end_angles):
+        self.servos = servos
+        self.rate = rate
+        self.frames = frames
+        self.end_angles = end_angles
+
+    @property
+    def num_frames(self):
+        return len(self.frames) // len(self.servos)
+
+    @property
+    def duration(self):
+        return self.num_frames / self.rate
+
+    def frame(self, index):
+        width = len(self.servos)
+        return self.frames[index * width:(index + 1) * width]
+
+    def steps(self, clock_start=0):
+        # the playback as a routine generator, see run_steps
+        # only the channels whose pulse width changed since the previous frame are written
+        period = 1.0 / self.rate
+        width = len(self.servos)
+        previous = [0] * width
+        for start in range(0, len(self.frames), width):
+            servo_ticks = []
+            for column in range(width):
+                pulse_width = self.frames[start + column]
+                if pulse_width != previous[column]:
+                    previous[column] = pulse_width
+                    servo_ticks.append((self.servos[column], (clock_start, pulse_width + clock_start)))
+            if servo_ticks:
+                set_servo_pwms(servo_ticks)
+            yield period
+        for servo, angle in zip(self.servos, self.end_angles):
+            if angle is not None:
+                servo.currentAngle = servo.pulse_width(angle)[0]
+
+    def play(self, clock_start=0):
+        run_steps(self.steps(clock_start))
+
+    async def play_async(self, clock_start=0):
+        await run_steps_async(self.steps(clock_start))
@@ -0,0 +1,203 @@
+import asyncio
+import time
+from itertools import repeat
+
+import numpy as np
+
+import PCAde9685
+import trajectories
+from PCAde9685 import handle_steps, log_move, logger, run_steps, run_steps_async, wait_for_async
+
+# Needs NumPy (pip install numpy), nothing else in the project does.
+
+
+class ServoBank:
+    # A group of servos kept as arrays instead of objects: the channels, bounds, calibration and current
+    # angles of all of them sit in NumPy arrays and a whole vector of angles is turned into ticks in one go.
+    # The Servo objects handed in become views into the bank: their currentAngle is read from and written to
+    # the bank's arrays and changing their calibration updates the bank, so code using the single servos
+    # keeps working. Call refresh() after moving a servo to another channel or backend.
+
+    def __init__(self, servos, info_print=False, scheduler=None):
+        self.servos = list(servos)
+        self.info_print = info_print
+        # with a MotionScheduler the whole bank is submitted at once and a handle is returned instead of sleeping
+        self.scheduler = scheduler
+        num_servos = len(self.servos)
+        self.channels = np.zeros(num_servos, dtype=np.int64)
+        self.min_bounds = np.zeros(num_servos)
+        self.max_bounds = np.zeros(num_servos)
+        self.angle_ranges = np.zeros(num_servos)
+        self.resolutions = np.zeros(num_servos)
+        self.min_pulse_us = np.zeros(num_servos)
+        self.max_pulse_us = np.zeros(num_servos)
+        self.min_ticks = np.zeros(num_servos)
+        self.max_ticks = np.zeros(num_servos)
+        # NaN while the angle is unknown
+        self.current_angles = np.full(num_servos, np.nan)
+        for index, servo in enumerate(self.servos):
+            angle = servo.currentAngle
+            servo.bank, servo.bank_index = self, index
+            servo.currentAngle = angle
+        self.refresh()
+
+    def __len__(self):
+        return len(self.servos)
+
+    def refresh(self, index=None):
+        # reads the channel, backend and calibration of every servo (or only the one at index) into the arrays
+        indices = range(len(self.servos)) if index is None else (index,)
+        for index in indices:
+            servo = self.servos[index]
+            self.channels[index] = servo.channel
+            self.min_bounds[index] = servo.servo_min_bound
+            self.max_bounds[index] = servo.servo_max_bound
+            self.angle_ranges[index] = servo.angle_range
+            self.resolutions[index] = servo.resolution
+            self.min_pulse_us[index] = servo.min_pulse_us
+            self.max_pulse_us[index] = servo.max_pulse_us
+        # servos that only need an angle remapped when their bounds are not 0 to 180
+        self.remapped = (self.min_bounds != 0) | (self.max_bounds != 180)
+        self.table_ends = np.round(180 / self.resolutions) + 1
+        backend_indices = {}
+        for index, servo in enumerate(self.servos):
+            backend_indices.setdefault(servo.pwm, []).append(index)
+        self.backend_indices = {backend: np.array(indices) for backend, indices in backend_indices.items()}
+        # the pulse widths in ticks are worked out again on the next write
+        self._frequencies = {}
+
+    def _update_ticks(self):
+        # pulse widths in ticks follow the frequency of each servo's backend
+        for backend, indices in self.backend_indices.items():
+            if self._frequencies.get(backend) != backend.frequency_hz:
+                self._frequencies[backend] = backend.frequency_hz
+                self.min_ticks[indices] = backend.microseconds_to_ticks(self.min_pulse_us[indices])
+                self.max_ticks[indices] = backend.microseconds_to_ticks(self.max_pulse_us[indices])
+
+    def angle_of(self, index):
+        angle = self.current_angles[index]
+        return "unknown" if np.isnan(angle) else float(angle)
+
+    def set_angle_of(self, index, angle):
+        self.current_angles[index] = np.nan if isinstance(angle, str) else angle
+
+    def pulse_widths(self, angles):
+        # Servo.pulse_width for every servo at once, with the same rounding as the servos' lookup tables.
+        # angles is one angle for all servos, one per servo, or one row per servo for several frames;
+        # returns the angles after remapping to each servo's bounds and the pulse widths in ticks.
+        self._update_ticks()
+        angles = np.asarray(angles, dtype=float) + np.zeros_like(self.min_bounds)
+
+        # within 0 to 180 degrees the angle is rounded to the servo's resolution first, like the lookup table
+        index = np.trunc(angles * (1 / self.resolutions) + 0.5)
+        in_table = (index >= 0) & (index < self.table_ends)
+        span = self.max_bounds - self.min_bounds
+        table_angles = np.minimum(index * self.resolutions, 180)
+        table_angles = np.where(self.remapped, self.min_bounds + table_angles / 180 * span, table_angles)
+        raw_angles = np.where(self.remapped, self.min_bounds + angles / 180 * span, angles)
+
+        pulse_angles = np.where(in_table, table_angles, raw_angles)
+        ticks = np.trunc(self.min_ticks + (self.max_ticks - self.min_ticks) * (pulse_angles / self.angle_ranges) + 0.5)
+        ticks = np.where(in_table, np.maximum(ticks, 0), ticks).astype(np.int64)
+        remapped_angles = np.where(in_table, self.min_bounds + angles * (span / 180), raw_angles)
+        return remapped_angles, ticks
+
+    def write_angles(self, angles, clock_start=0):
+        # writes the angles right away, one bulk write per backend
+        if not 0 <= clock_start <= 4095:
+            logger.warning("Invalid clock start time %s, resetting to zero...", clock_start)
+            clock_start = 0
+        self.current_angles[:], ticks = self.pulse_widths(angles)
+        self._write_ticks(ticks, clock_start)
+
+    def _write_ticks(self, ticks, clock_start):
+        off_ticks = ticks + clock_start
+        for backend, indices in self.backend_indices.items():
+            backend.set_multiple_pwm(dict(zip(self.channels[indices].tolist(),
+                                              zip(repeat(clock_start), off_ticks[indices].tolist()))))
+
+    # the same interface as ServoGroup2, the angles can also be one per servo
+
+    def write_angle(self, angle=90, clock_start=0):
+        self.write_angles(angle, clock_start)
+
+    def set_angle(self, angle=90, delay_amount=1.0, clock_start=0):
+        log_move(self.info_print, self, "Setting Servo Bank to %s and waiting %s seconds", angle, delay_amount)
+        if self.scheduler is not None:
+            return self._schedule_angle(angle, delay_amount, clock_start)
+
+        self.write_angles(angle, clock_start)
+        time.sleep(delay_amount)
+
+    async def set_angle_async(self, angle=90, delay_amount=1.0, clock_start=0):
+        log_move(self.info_print, self, "Setting Servo Bank to %s and waiting %s seconds", angle, delay_amount)
+        if self.scheduler is not None:
+            await wait_for_async(self._schedule_angle(angle, delay_amount, clock_start))
+            return
+
+        self.write_angles(angle, clock_start)
+        await asyncio.sleep(delay_amount)
+
+    def _schedule_angle(self, angle, delay_amount, clock_start):
+        if not 0 <= clock_start <= 4095:
+            logger.warning("Invalid clock start time %s, resetting to zero...", clock_start)
+            clock_start = 0
+        angles = self._angle_list(angle)
+        return self.scheduler.submit_group(self.servos, angles, angles, 0, delay_amount, clock_start)
+
+    def _angle_list(self, angle):
+        # one float per servo for the scheduler, from a single angle or a vector of them
+        return np.broadcast_to(np.asarray(angle, dtype=float), len(self.servos)).tolist()
+
+    def _schedule_glide(self, starting_angle, ending_angle, time_to_take, easing, max_acceleration):
+        return self.scheduler.submit_group(self.servos, self._angle_list(starting_angle),
+                                           self._angle_list(ending_angle), time_to_take,
+                                           easing=easing, max_acceleration=max_acceleration)
+
+    def glide_steps(self, starting_angle, ending_angle, time_to_take, update_rate=None, easing=None,
+                    max_acceleration=None):
+        # the glide as a routine generator, see run_steps
+        # every frame of the glide is converted to ticks in one go before the first write
+        if self.scheduler is not None:
+            yield from handle_steps(
+                self._schedule_glide(starting_angle, ending_angle, time_to_take, easing, max_acceleration))
+            return
+
+        if update_rate is None:
+            update_rate = PCAde9685.glide_rate
+        if easing is None:
+            easing = PCAde9685.glide_easing
+        starting_angles = np.asarray(starting_angle, dtype=float) + np.zeros_like(self.min_bounds)
+        spans = np.asarray(ending_angle, dtype=float) - starting_angles
+        # the servo with the furthest to go sets the acceleration limit
+        easing, time_to_take, accel_fraction = trajectories.plan(
+            float(np.max(np.abs(spans))), time_to_take, easing, max_acceleration)
+        frame_time, table = trajectories.progress_table(easing, time_to_take, update_rate, accel_fraction)
+        frame_angles, frame_ticks = self.pulse_widths(starting_angles + np.outer(table, spans))
+
+        self.write_angles(starting_angles)
+        for angles, ticks in zip(frame_angles, frame_ticks):
+            yield frame_time
+            self.current_angles[:] = angles
+            self._write_ticks(ticks, 0)
+
+    def glide_angle(self, starting_angle, ending_angle, time_to_take, update_rate=None, easing=None,
+                    max_acceleration=None):
+        log_move(self.info_print, self, "Servo Bank gliding from angle %s to %s in %s seconds",
+                 starting_angle, ending_angle, time_to_take)
+        if self.scheduler is not None:
+            return self._schedule_glide(starting_angle, ending_angle, time_to_take, easing, max_acceleration)
+
+        run_steps(self.glide_steps(starting_angle, ending_angle, time_to_take, update_rate, easing, max_acceleration))
+
+    async def glide_angle_async(self, starting_angle, ending_angle, time_to_take, update_rate=None, easing=None,
+                                max_acceleration=None):
+        log_move(self.info_print, self, "Servo Bank gliding from angle %s to %s in %s seconds",
+                 starting_angle, ending_angle, time_to_take)
+        if self.scheduler is not None:
+            await wait_for_async(
+                self._schedule_glide(starting_angle, ending_angle, time_to_take, easing, max_acceleration))
+            return
+
+        await run_steps_async(
+            self.glide_steps(starting_angle, ending_angle, time_to_take, update_rate, easing, max_acceleration))
@@ -0,0 +1,184 @@
+import mmap
+import struct
+import sys
+from array import array
+
+from PCAde9685 import glide_rate, run_steps, run_steps_async, servo_backend
+
+# A show file is a whole animation rendered ahead of time, played back by streaming it out of a memory map.
+#
+# Layout, all little-endian:
+#   header       magic b"PKSH", version (uint16), number of channels (uint16), number of frames (uint32),
+#                frames per second (float32)
+#   channel map  the channel number of every column (uint16 each), global channels when played on a ControllerPool
+#   frames       one row of pulse widths in ticks (uint16) per frame, one column per channel.
+#                A pulse width of 0 leaves the channel alone.
+#
+# Frame n is written n / rate seconds after the start.
+
+SHOW_MAGIC = b"PKSH"
+SHOW_VERSION = 1
+HEADER = struct.Struct("<4sHHIf")
+
+
+class _ShowRecorder:
+    # Stands in for the servos' backend while a routine is rendered: the writes only update the current
+    # pulse width of every channel, everything else (frequency, calibration) comes from the real backend.
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.pulse_widths = {}
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def set_pwm(self, channel, on, off):
+        self.pulse_widths[channel] = off - on
+
+    def set_multiple_pwm(self, channel_ticks):
+        for channel, (on, off) in channel_ticks.items():
+            self.pulse_widths[channel] = off - on
+
+
+def render_show(path, steps, servos, rate=None):
+    # Runs a routine generator (see run_steps) on a virtual clock instead of sleeping and writes every
+    # frame of it to path, eg. render_show("rows.show", pumpkin.rows_steps(), pumpkin.eyes).
+    # servos are every servo the routine moves, they have to share one backend.
+    # A longer show is a chain of routines: itertools.chain(pumpkin.rows_steps(), pumpkin.columns_steps())
+    if rate is None:
+        rate = glide_rate
+    backends = {servo.pwm for servo in servos}
+    if len(backends) != 1:
+        raise ValueError("All servos of a show have to be on the same backend")
+    recorder = _ShowRecorder(backends.pop())
+    channels = [servo.channel for servo in servos]
+
+    frame = array('H', [0] * len(channels))
+    num_frames = 0
+    elapsed = 0.0
+    with open(path, "wb") as show_file:
+        # the number of frames is filled in once the routine has finished
+        show_file.write(HEADER.pack(SHOW_MAGIC, SHOW_VERSION, len(channels), 0, rate))
+        write_array(show_file, array('H', channels))
+
+        for servo in servos:
+            servo.pwm = recorder
+        try:
+            for delay_amount in steps:
+                elapsed += delay_amount
+                end_frame = int(round(elapsed * rate))
+                if end_frame > num_frames:
+                    update_frame(frame, channels, recorder.pulse_widths)
+                    for _ in range(end_frame - num_frames):
+                        write_array(show_file, frame)
+                    num_frames = end_frame
+        finally:
+            for servo in servos:
+                servo.pwm = recorder.backend
+
+        # a last frame so whatever the routine ends on is written too
+        last_frame = array('H', frame)
+        update_frame(frame, channels, recorder.pulse_widths)
+        if num_frames == 0 or frame != last_frame:
+            write_array(show_file, frame)
+            num_frames += 1
+
+        show_file.seek(0)
+        show_file.write(HEADER.pack(SHOW_MAGIC, SHOW_VERSION, len(channels), num_frames, rate))
+    return num_frames
+
+
+def update_frame(frame, channels, pulse_widths):
+    for column, channel in enumerate(channels):
+        frame[column] = pulse_widths.get(channel, 0)
+
+
+def write_array(show_file, values):
+    if sys.byteorder == "big":
+        values = array('H', values)
+        values.byteswap()
+    values.tofile(show_file)
+
+
+class Show:
+    # A show file opened for playback. The frames are read straight out of the memory map, nothing is
+    # loaded up front, so a show of several hours opens instantly and costs no memory of its own.
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, num_channels, self.num_frames, self.rate = HEADER.unpack_from(self._map)
+        if magic != SHOW_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a show file")
+        if version != SHOW_VERSION:
+            self.close()
+            raise ValueError(f"{path} is a version {version} show, only version {SHOW_VERSION} can be played")
+        map_end = HEADER.size + 2 * num_channels
+        frames_end = map_end + 2 * num_channels * self.num_frames
+        self.channels = tuple(struct.unpack_from(f"<{num_channels}H", self._map, HEADER.size))
+        if sys.byteorder == "big":
+            # the frames are stored little-endian, swap them once into memory
+            self.frames = array('H', self._map[map_end:frames_end])
+            self.frames.byteswap()
+        else:
+            self.frames = memoryview(self._map)[map_end:frames_end].cast('H')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(getattr(self, "frames", None), memoryview):
+            self.frames.release()
+        self._map.close()
+        self._file.close()
+
+    @property
+    def duration(self):
+        return self.num_frames / self.rate
+
+    def frame_at(self, seconds):
+        # the frame that is showing seconds into the show
+        return min(self.num_frames - 1, max(0, int(seconds * self.rate)))
+
+    def frame(self, index):
+        # a copy, so nothing keeps the memory map open
+        width = len(self.channels)
+        return tuple(self.frames[index * width:(index + 1) * width])
+
+    def steps(self, pwm_backend=None, start=0.0, loop=False, clock_start=0):
+        # the playback as a routine generator (see run_steps), starting start seconds into the show
+        # with loop it starts over at the beginning until the generator is closed
+        # only the channels whose pulse width changed since the previous frame are written
+        backend = servo_backend(pwm_backend)
+        period = 1.0 / self.rate
+        width = len(self.channels)
+        channels = self.channels
+        frames = self.frames
+        previous = [0] * width
+        channel_ticks = {}
+        start_frame = self.frame_at(start)
+        while True:
+            for offset in range(start_frame * width, self.num_frames * width, width):
+                channel_ticks.clear()
+                for column in range(width):
+                    pulse_width = frames[offset + column]
+                    if pulse_width != previous[column]:
+                        previous[column] = pulse_width
+                        channel_ticks[channels[column]] = (clock_start, pulse_width + clock_start)
+                if channel_ticks:
+                    backend.set_multiple_pwm(channel_ticks)
+                yield period
+            if not loop:
+                return
+            start_frame = 0
+
+    def play(self, pwm_backend=None, start=0.0, loop=False, clock_start=0):
+        run_steps(self.steps(pwm_backend, start, loop, clock_start))
+
+    async def play_async(self, pwm_backend=None, start=0.0, loop=False, clock_start=0):
+        await run_steps_async(self.steps(pwm_backend, start, loop, clock_start))
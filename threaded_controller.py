@@ -0,0 +1,216 @@
+import queue
+import threading
+
+from PCAde9685 import logger
+from controller_pool import ControllerPool
+from pca9685_backends import NUM_CHANNELS
+
+# Lets any number of threads move servos at the same time. Every I2C bus gets one writer thread that
+# does all of the bus's transactions, so the register writes of different channels can never interleave
+# and nobody has to hold a lock while the slow I2C calls run:
+#     controller = ThreadedController(PCAde9685.pwm)      or a ControllerPool, one writer per bus
+#     eye = Servo(0, pwm_backend=controller)               set_angle now only queues the write
+#     ...
+#     controller.flush()                                   waits until everything queued so far is on the chip
+#     controller.close()
+
+
+class WriteBarrier:
+    # Returned by ThreadedController.barrier: done once every write queued before it has gone out
+
+    def __init__(self, events):
+        self.events = events
+
+    def done(self):
+        return all(event.is_set() for event in self.events)
+
+    def wait(self, timeout=None):
+        # returns False on timeout
+        for event in self.events:
+            if not event.wait(timeout):
+                return False
+        return True
+
+
+class BusWriter:
+    # The thread that owns one bus. Producers put {channel: (on, off)} dicts, barriers (threading.Event)
+    # and callables on a bounded queue; a full queue makes them wait, which keeps them from running ahead
+    # of the bus. Before every write the dicts waiting in the queue are merged with the last ticks queued
+    # for a channel winning, so a channel that was set several times in the meantime is written once.
+
+    def __init__(self, target, name, max_pending=64):
+        # target.set_multiple_pwm does the writes, it is only ever called from this thread
+        self.target = target
+        self.queue = queue.Queue(max_pending)
+        self.error = None
+        self.coalesced = 0
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def _write(self, pending):
+        try:
+            self.target.set_multiple_pwm(pending)
+        except Exception as error:
+            # the thread carries on with the next writes, the error is raised by the next flush
+            logger.exception("Writing channels %s from %s failed", sorted(pending), self.thread.name)
+            self.error = error
+        pending.clear()
+
+    def _run(self):
+        pending = {}
+        while True:
+            # block for the first item, then take whatever else is already waiting
+            item = self.queue.get()
+            while True:
+                if item is None:
+                    self._write(pending)
+                    return
+                if isinstance(item, dict):
+                    self.coalesced += len(pending.keys() & item.keys())
+                    pending.update(item)
+                else:
+                    # barriers and callables only run after everything queued before them was written
+                    if pending:
+                        self._write(pending)
+                    if isinstance(item, threading.Event):
+                        item.set()
+                    else:
+                        try:
+                            item()
+                        except Exception as error:
+                            logger.exception("%s failed on %s", item, self.thread.name)
+                            self.error = error
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if pending:
+                self._write(pending)
+
+    def stop(self):
+        # writes whatever is still queued first
+        self.queue.put(None)
+        self.thread.join()
+
+
+class ThreadedController:
+    # Puts a writer thread (see BusWriter) in front of a PWMBackend or a ControllerPool and has the same
+    # interface, so it can be handed to Servo, ServoGroup2, ServoPumpkin and ServoBank as their pwm_backend.
+    # Writes are queued and return right away. Add every board to a pool before wrapping it.
+
+    def __init__(self, backend, max_pending=64):
+        self.backend = backend
+        # {bus: [backends on it]}, a single backend is a bus of its own
+        if isinstance(backend, ControllerPool):
+            self.buses = backend.buses()
+        else:
+            self.buses = {backend.chip_key()[0]: [backend]}
+        self.writers = {bus: BusWriter(backend, f"i2c-writer-{index}", max_pending)
+                        for index, bus in enumerate(self.buses)}
+        self.bus_of = {backend: bus for bus, backends in self.buses.items() for backend in backends}
+
+    def writer(self, channel):
+        if isinstance(self.backend, ControllerPool):
+            return self.writers[self.bus_of[self.backend.locate(channel)[0]]]
+        return self.writers[self.bus_of[self.backend]]
+
+    # the same interface as a single PWMBackend
+
+    @property
+    def frequency_hz(self):
+        return self.backend.frequency_hz
+
+    @property
+    def actual_frequency(self):
+        return self.backend.actual_frequency
+
+    def microseconds_to_ticks(self, microseconds):
+        return self.backend.microseconds_to_ticks(microseconds)
+
+    @property
+    def cache_hits(self):
+        return self.backend.cache_hits
+
+    @property
+    def cache_misses(self):
+        return self.backend.cache_misses
+
+    @property
+    def num_channels(self):
+        if isinstance(self.backend, ControllerPool):
+            return NUM_CHANNELS * len(self.backend.boards)
+        return NUM_CHANNELS
+
+    def set_pwm(self, channel, on, off):
+        self.writer(channel).put({channel: (on, off)})
+
+    def set_multiple_pwm(self, channel_ticks):
+        # split per bus, every writer gets its part as one item
+        bus_ticks = {}
+        for channel, ticks in channel_ticks.items():
+            bus_ticks.setdefault(self.writer(channel), {})[channel] = ticks
+        for writer, ticks in bus_ticks.items():
+            writer.put(ticks)
+
+    def set_all_pwm(self, on, off):
+        # the backend turns this back into ALL_LED writes when nothing is staggered
+        self.set_multiple_pwm(dict.fromkeys(range(self.num_channels), (on, off)))
+
+    def set_pwm_freq(self, freq_hz):
+        # the frequency is changed by the writer threads in between writes, this waits until it has been
+        if freq_hz == self.frequency_hz:
+            return
+        if isinstance(self.backend, ControllerPool):
+            self.backend.frequency_hz = freq_hz
+        self._on_every_backend(lambda backend: backend.set_pwm_freq(freq_hz))
+        self.flush()
+
+    def invalidate_cache(self):
+        self._on_every_backend(lambda backend: backend.invalidate_cache())
+
+    def _on_every_backend(self, function):
+        # queues function(backend) for every backend, it runs on the writer thread of the backend's bus
+        for bus, writer in self.writers.items():
+            def run(backends=self.buses[bus]):
+                for backend in backends:
+                    function(backend)
+            writer.put(run)
+
+    def barrier(self):
+        # returns right away, the WriteBarrier is done once everything queued until now has been written
+        events = []
+        for writer in self.writers.values():
+            event = threading.Event()
+            writer.put(event)
+            events.append(event)
+        return WriteBarrier(events)
+
+    def flush(self, timeout=None):
+        # waits until everything queued until now has been written, returns False on timeout
+        # a write that failed in the meantime is raised here
+        done = self.barrier().wait(timeout)
+        for writer in self.writers.values():
+            if writer.error is not None:
+                error, writer.error = writer.error, None
+                raise error
+        return done
+
+    def stats(self):
+        # channel writes that were dropped because a later one for the same channel was queued before them
+        return {"coalesced": sum(writer.coalesced for writer in self.writers.values()),
+                "pending": sum(writer.queue.qsize() for writer in self.writers.values())}
+
+    def close(self):
+        # writes everything still queued and stops the writer threads
+        for writer in self.writers.values():
+            writer.stop()
+        self.writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
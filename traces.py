@@ -0,0 +1,242 @@
+import struct
+import time
+
+from PCAde9685 import run_steps, run_steps_async, servo_backend
+from pca9685_backends import ALL_LED_OFF_H, ALL_LED_ON_L, LED0_ON_L, NUM_CHANNELS, BackendWrapper
+
+# A trace is every register write a backend made, with the time it was made at. Record one by giving
+# servos a RecordingBackend, eg.
+#     recorder = RecordingBackend(PCAde9685.pwm)
+#     pumpkin = ServoPumpkin(*eyes, pwm_backend=recorder)
+#     pumpkin.ladders(0, 2, 0.1)
+#     recorder.trace.save("ladders.trace")
+# and replay it with play_trace(Trace.load("ladders.trace")).
+#
+# File layout, all little-endian: magic b"PKTR", version (uint16), number of writes (uint32), then per write
+# the microseconds since the previous write (uint32), the register (uint8), the number of data bytes (uint8)
+# and the data bytes.
+
+TRACE_MAGIC = b"PKTR"
+TRACE_VERSION = 1
+HEADER = struct.Struct("<4sHI")
+RECORD = struct.Struct("<IBB")
+# the most data bytes coalescing puts into one write, the SMBus block limit
+MAX_BLOCK_BYTES = 32
+LED_REGISTERS = range(LED0_ON_L, LED0_ON_L + 4 * NUM_CHANNELS)
+
+
+def store_write(image, register, data):
+    # applies a write (with auto-increment) to image, a {register: value} dict of the LED registers
+    for value in data:
+        if ALL_LED_ON_L <= register <= ALL_LED_OFF_H:
+            for channel in range(NUM_CHANNELS):
+                image[LED0_ON_L + 4 * channel + register - ALL_LED_ON_L] = value
+        elif register in LED_REGISTERS:
+            image[register] = value
+        register += 1
+
+
+class Trace:
+    def __init__(self, data=b"", num_writes=0):
+        self.data = bytearray(data)
+        self.num_writes = num_writes
+        self.end_us = sum(time_us for time_us, _, _ in self._records())
+
+    def __len__(self):
+        return self.num_writes
+
+    def _records(self):
+        # (microseconds since the previous write, register, data)
+        offset = 0
+        while offset < len(self.data):
+            delta_us, register, length = RECORD.unpack_from(self.data, offset)
+            offset += RECORD.size
+            yield delta_us, register, bytes(self.data[offset:offset + length])
+            offset += length
+
+    def __iter__(self):
+        # (seconds since the first write, register, data) for every write
+        time_us = 0
+        for delta_us, register, data in self._records():
+            time_us += delta_us
+            yield time_us / 1000000.0, register, data
+
+    def append(self, time_us, register, data):
+        # time_us is the time of the write in microseconds since the first one, writes are appended in order
+        time_us = max(time_us, self.end_us)
+        self.data += RECORD.pack(time_us - self.end_us, register, len(data))
+        self.data += bytes(data)
+        self.end_us = time_us
+        self.num_writes += 1
+
+    @property
+    def duration(self):
+        return self.end_us / 1000000.0
+
+    def save(self, path):
+        with open(path, "wb") as trace_file:
+            trace_file.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, self.num_writes))
+            trace_file.write(self.data)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as trace_file:
+            contents = trace_file.read()
+        magic, version, num_writes = HEADER.unpack_from(contents)
+        if magic != TRACE_MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        if version != TRACE_VERSION:
+            raise ValueError(f"{path} is a version {version} trace, only version {TRACE_VERSION} can be read")
+        return cls(contents[HEADER.size:], num_writes)
+
+    def stats(self):
+        # What the trace puts on the bus. A redundant write is one that leaves every LED register it
+        # touches unchanged, those are the writes coalescing and caching can drop.
+        image = {}
+        stats = {"writes": self.num_writes, "bytes": 0, "redundant_writes": 0, "duration": self.duration}
+        for _, register, data in self:
+            # address+W and the register go out with every write
+            stats["bytes"] += 2 + len(data)
+            before = dict(image)
+            store_write(image, register, data)
+            led_write = register in LED_REGISTERS or ALL_LED_ON_L <= register <= ALL_LED_OFF_H
+            if led_write and before and image == before:
+                stats["redundant_writes"] += 1
+        return stats
+
+    def coalesced(self, window=0.005):
+        # A new trace with the LED writes of every window seconds merged: the last value written to each
+        # register wins, registers that already hold their value are dropped and what is left goes out in
+        # as few block writes as possible at the time of the window's first write. A window that would take
+        # more transactions (or as many but more bytes) that way is kept as it was, so the result is never
+        # more writes than the trace itself.
+        # Anything else (mode, prescaler and ALL_LED writes) is kept as it is and in order.
+        result = Trace()
+        image = {}
+        pending = {}
+        pending_writes = []
+        pending_time = None
+
+        def flush():
+            writes = merged_writes(image, pending, pending_time)
+            if write_cost(writes) > write_cost(pending_writes):
+                writes = list(pending_writes)
+            for time_us, register, data in writes:
+                result.append(time_us, register, data)
+                store_write(image, register, data)
+            pending.clear()
+            pending_writes.clear()
+
+        for seconds, register, data in self:
+            time_us = int(round(seconds * 1000000))
+            led_write = register in LED_REGISTERS and register + len(data) <= LED_REGISTERS.stop
+            if pending_writes and (not led_write or time_us - pending_time >= window * 1000000):
+                flush()
+            if not led_write:
+                result.append(time_us, register, data)
+                store_write(image, register, data)
+                continue
+            if not pending_writes:
+                pending_time = time_us
+            pending_writes.append((time_us, register, data))
+            for offset, value in enumerate(data):
+                pending[register + offset] = value
+        if pending_writes:
+            flush()
+        return result
+
+
+def write_cost(writes):
+    # (transactions, data bytes) of a list of (time, register, data) writes
+    return len(writes), sum(len(data) for time_us, register, data in writes)
+
+
+def merged_writes(image, pending, time_us):
+    # The (time, register, data) block writes that bring the LED registers from image to image + pending.
+    # Every transaction costs the address and register bytes and a round trip to the driver, so a changed
+    # channel is written as its whole 4-register slot when all of its values are known: that way
+    # neighbouring channels join up into one block even when only their OFF_L bytes changed. A gap of
+    # up to one known slot between two blocks is filled in rather than starting another transaction.
+    def known(register):
+        return register in pending or register in image
+
+    registers = set()
+    for register, value in pending.items():
+        if image.get(register) == value:
+            continue
+        slot = register - (register - LED0_ON_L) % 4
+        slot_registers = range(slot, slot + 4)
+        if all(known(slot_register) for slot_register in slot_registers):
+            registers.update(slot_registers)
+        else:
+            registers.add(register)
+
+    runs = []
+    for register in sorted(registers):
+        if runs:
+            run_start, run_end = runs[-1]
+            gap = range(run_end + 1, register)
+            if (len(gap) <= 4 and register - run_start < MAX_BLOCK_BYTES
+                    and all(known(gap_register) for gap_register in gap)):
+                runs[-1] = (run_start, register)
+                continue
+        runs.append((register, register))
+    return [(time_us, run_start, [pending.get(register, image.get(register))
+                                  for register in range(run_start, run_end + 1)])
+            for run_start, run_end in runs]
+
+
+class RecordingBackend(BackendWrapper):
+    # Wraps another backend and adds every register write it makes to a Trace, timestamped on the
+    # monotonic clock. The writes still go to the wrapped backend, so the routine runs as usual.
+
+    def __init__(self, backend, trace=None):
+        super().__init__(backend)
+        self.trace = trace if trace is not None else Trace()
+        self.start_ns = None
+
+    def record(self, register, data):
+        now = time.monotonic_ns()
+        if self.start_ns is None:
+            self.start_ns = now
+        self.trace.append((now - self.start_ns) // 1000, register, data)
+
+    def write8(self, register, value):
+        self.record(register, [value])
+        self.backend.write8(register, value)
+
+    def write_list(self, register, data):
+        self.record(register, data)
+        self.backend.write_list(register, data)
+
+
+def trace_steps(trace, pwm_backend=None):
+    # the replay as a routine generator (see run_steps), every write goes out at its recorded time
+    backend = servo_backend(pwm_backend)
+    if not backend.ready:
+        backend.ensure_ready()
+    previous = 0.0
+    try:
+        for seconds, register, data in trace:
+            yield seconds - previous
+            previous = seconds
+            if len(data) == 1:
+                backend.write8(register, data[0])
+            else:
+                backend.write_list(register, list(data))
+    finally:
+        # the registers were written behind the backend's back
+        backend.invalidate_cache()
+
+
+def play_trace(trace, pwm_backend=None, coalesce=None):
+    # with coalesce the writes of every coalesce seconds are merged first, see Trace.coalesced
+    if coalesce:
+        trace = trace.coalesced(coalesce)
+    run_steps(trace_steps(trace, pwm_backend))
+
+
+async def play_trace_async(trace, pwm_backend=None, coalesce=None):
+    if coalesce:
+        trace = trace.coalesced(coalesce)
+    await run_steps_async(trace_steps(trace, pwm_backend))
@@ -0,0 +1,100 @@
+import math
+from functools import lru_cache
+
+
+# Easing curves map the fraction of the glide's time that has passed (0 to 1)
+# to the fraction of the distance that should be covered by then (0 to 1)
+
+def linear(t):
+    return t
+
+
+def ease_in(t):
+    return t * t
+
+
+def ease_out(t):
+    return t * (2 - t)
+
+
+def ease_in_out(t):
+    if t < 0.5:
+        return 2 * t * t
+    return 1 - 2 * (1 - t) * (1 - t)
+
+
+def cubic(t):
+    # ease in and out with a cubic, gentler at both ends than ease_in_out
+    if t < 0.5:
+        return 4 * t * t * t
+    return 1 - 4 * (1 - t) * (1 - t) * (1 - t)
+
+
+def sine(t):
+    return 0.5 - 0.5 * math.cos(math.pi * t)
+
+
+def trapezoid(t, accel_fraction=1.0 / 3):
+    # trapezoidal velocity profile: constant acceleration for accel_fraction of the time,
+    # cruise at constant speed, then constant deceleration for the last accel_fraction
+    if accel_fraction <= 0:
+        return t
+    top_speed = 1.0 / (1.0 - accel_fraction)
+    if t < accel_fraction:
+        return 0.5 * top_speed * t * t / accel_fraction
+    if t > 1.0 - accel_fraction:
+        return 1.0 - 0.5 * top_speed * (1.0 - t) * (1.0 - t) / accel_fraction
+    return top_speed * (t - 0.5 * accel_fraction)
+
+
+curves = {
+    "linear": linear,
+    "ease_in": ease_in,
+    "ease_out": ease_out,
+    "ease_in_out": ease_in_out,
+    "cubic": cubic,
+    "sine": sine,
+    "trapezoid": trapezoid,
+}
+
+
+def acceleration_limited(distance, duration, max_acceleration):
+    # Fits a trapezoidal profile that never accelerates faster than max_acceleration (degrees per second squared).
+    # Returns (accel_fraction, duration), the duration is stretched when the move cannot be done in time.
+    distance = abs(distance)
+    if distance == 0 or max_acceleration is None:
+        return 0.0, duration
+    shortest = 2 * math.sqrt(distance / max_acceleration)
+    if duration <= shortest:
+        # accelerate for half the time and decelerate for the other half
+        return 0.5, shortest
+    # distance = max_acceleration * accel_time * (duration - accel_time)
+    accel_time = (duration - math.sqrt(duration * duration - 4 * distance / max_acceleration)) / 2
+    return accel_time / duration, duration
+
+
+def plan(distance, duration, easing="linear", max_acceleration=None):
+    # Picks the profile for a move of distance degrees, returns (easing, duration, accel_fraction).
+    # With max_acceleration the move always uses a trapezoid profile that respects it.
+    if max_acceleration is not None:
+        accel_fraction, duration = acceleration_limited(distance, duration, max_acceleration)
+        return "trapezoid", duration, accel_fraction
+    if easing not in curves:
+        raise ValueError(f"Unknown easing curve {easing}, choose from {', '.join(curves)}")
+    return easing, duration, None
+
+
+def progress_at(easing, t, accel_fraction=None):
+    if easing == "trapezoid" and accel_fraction is not None:
+        return trapezoid(t, accel_fraction)
+    return curves[easing](t)
+
+
+@lru_cache(maxsize=256)
+def progress_table(easing, duration, update_rate, accel_fraction=None):
+    # The whole profile computed once: (seconds per frame, tuple of the fraction of the distance
+    # covered at the end of every frame). Cached, so gliding only does one multiply-add per frame.
+    num_frames = max(1, int(round(duration * update_rate)))
+    frame_time = duration / num_frames
+    table = tuple(progress_at(easing, frame / num_frames, accel_fraction) for frame in range(1, num_frames + 1))
+    return frame_time, table